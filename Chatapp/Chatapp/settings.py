@@ -41,8 +41,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'chat.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -54,7 +55,7 @@ ROOT_URLCONF = 'Chatapp.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'chat.template_backends.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,6 +83,42 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Per-process memory cache; point this at Redis or Memcached when running
+# several workers so fragment caches and invalidations are shared.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chat',
+        'OPTIONS': {
+            # The default of 300 cannot hold the friend graph (two keys per user) and culls constantly
+            'MAX_ENTRIES': 250000,
+        },
+    }
+}
+
+CHAT_LIST_CACHE_SECONDS = 600  # user_list / friends_list fragments, invalidated on relationship changes
+CHAT_MESSAGE_CACHE_SECONDS = 86400  # Rendered message bubbles, keyed by (message id, status)
+CHAT_FRIEND_GRAPH_CACHE_SECONDS = 3600  # Cached per-user friend id sets, invalidated on friendship changes
+CHAT_SYNC_SNAPSHOT_MESSAGES = 200  # Messages rendered on page open and sent to a device's first sync
+CHAT_SYNC_BATCH_SIZE = 500  # Changelog entries per sync response
+CHAT_SYNC_SETTLE_SECONDS = 5  # Sync cursors stay behind changelog entries younger than this (ids can commit out of order)
+CHAT_MESSAGE_TTL_CHOICES = [
+    # (seconds, label) offered for disappearing messages; 0 keeps messages
+    (0, 'Off'),
+    (3600, '1 hour'),
+    (86400, '1 day'),
+    (604800, '1 week'),
+]
+CHAT_MESSAGE_RETENTION_DAYS = None  # Delete every message older than this (None keeps history)
+CHAT_CHANGELOG_RETENTION_DAYS = 30  # Devices offline for longer re-sync from a fresh snapshot
+CHAT_PURGE_BATCH_SIZE = 1000  # Rows per transaction in `manage.py purge_messages`
+CHAT_BULK_MAX_ITEMS = 500  # Largest list accepted by the bulk friend/block APIs
+CHAT_ADMIN_ESTIMATED_COUNT_ABOVE = 100000  # Admin changelists use the PostgreSQL row estimate for bigger tables
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -134,5 +171,45 @@ LOGOUT_REDIRECT_URL = 'login'
 
 # Session settings - Keep users logged in after browser closes
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds (60 * 60 * 24 * 14)
-SESSION_SAVE_EVERY_REQUEST = True  # Extend session expiry on every request
+SESSION_SAVE_EVERY_REQUEST = True  # Extend session expiry on every request, except heartbeat/polling APIs
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Keep session even after browser closes
+
+# Request metrics - per-view query count, DB time, template time and payload size
+# exposed at /metrics in Prometheus format. The middleware removes itself when disabled.
+CHAT_METRICS_ENABLED = False
+CHAT_METRICS_TOKEN = ''  # Bearer token for scrapers; staff users can always read /metrics
+CHAT_SLOW_REQUEST_MS = 500  # Log requests slower than this with their slowest SQL
+CHAT_SLOW_REQUEST_QUERIES = 10  # Number of queries included in the slow-request log
+
+# Rate limiting - token buckets per user and endpoint scope
+CHAT_RATE_LIMIT_STORE = 'memory'  # 'memory' (per worker) or 'cache' (shared through CACHES)
+CHAT_RATE_LIMITS = {
+    # scope: (tokens per second, burst)
+    'send': (1.0, 10),
+    'poll': (1.0, 10),
+    'notifications': (0.5, 5),
+    'presence': (1.0, 10),
+    'friends': (0.2, 5),
+}
+CHAT_SERVER_POLL_BUDGETS = {
+    # scope: (requests per second, burst) across all users before clients are told to back off
+    'poll': (200.0, 400),
+    'notifications': (100.0, 200),
+}
+CHAT_POLL_INTERVAL_MS = 2000  # Advised polling interval when the server is not loaded
+CHAT_POLL_INTERVAL_MAX_MS = 30000  # Upper bound for the advised interval under load
+
+# Background tasks - processed by `python manage.py run_tasks`
+CHAT_TASKS_ALWAYS_EAGER = False  # True runs tasks in the web process after commit (no worker needed)
+CHAT_TASK_WORKERS = 4  # Worker threads per run_tasks process
+CHAT_TASK_VISIBILITY_TIMEOUT = 300  # Seconds before an unfinished claimed task is retried elsewhere
+
+# Presence - online/last-seen and typing indicators, never written to the database
+CHAT_PRESENCE_STORE = 'memory'  # 'memory' (per worker) or 'cache' (shared through CACHES)
+CHAT_PRESENCE_HEARTBEAT_SECONDS = 20  # How often open chat pages send a heartbeat
+CHAT_PRESENCE_ONLINE_SECONDS = 45  # Shown as online if a heartbeat arrived within this window
+CHAT_PRESENCE_TYPING_SECONDS = 6  # Typing indicator lifetime without a fresh keystroke
+CHAT_PRESENCE_LAST_SEEN_SECONDS = 604800  # How long "last seen" is remembered (1 week)
+
+# Polling API wire format - see chat/encoding.py. Optional extras: msgpack, brotli
+CHAT_COMPRESS_MIN_BYTES = 1024  # Compress API responses at least this large (gzip/br per Accept-Encoding)
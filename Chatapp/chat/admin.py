@@ -1,17 +1,99 @@
+from django.conf import settings
+from django import forms
 from django.contrib import admin
-from .models import Message, Friendship, BlockedUser
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Substr
+from django.utils.functional import cached_property
+from .models import Message, ChangeLogEntry, Friendship, BlockedUser, Room, RoomMembership, RoomMessage, Task
+
+
+CONTENT_PREVIEW_LENGTH = 50
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that reads the planner's row estimate instead of running
+    COUNT(*) over an unfiltered table, on PostgreSQL, once the table is
+    larger than CHAT_ADMIN_ESTIMATED_COUNT_ABOVE. Filtered querysets and
+    other databases are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > getattr(settings, 'CHAT_ADMIN_ESTIMATED_COUNT_ABOVE', 100000):
+                return row[0]
+        return super().count
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
+    """Changelist that stays usable on very large message tables"""
     list_display = ['sender', 'receiver', 'content_preview', 'status', 'timestamp', 'is_read']
-    list_filter = ['status', 'is_read', 'timestamp']
+    list_filter = ['status', 'is_read']
+    list_select_related = ['sender', 'receiver']
+    date_hierarchy = 'timestamp'
+    ordering = ['-id']
     search_fields = ['sender__username', 'receiver__username', 'content']
+    search_help_text = 'Username prefix or words in the message'
     readonly_fields = ['timestamp', 'delivered_at', 'read_at']
+    raw_id_fields = ['sender', 'receiver']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        # Only the start of the content is needed for the list; the change form loads the rest
+        return super().get_queryset(request).defer('content').annotate(
+            content_excerpt=Substr('content', 1, CONTENT_PREVIEW_LENGTH + 1)
+        )
+    
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        
+        # Match usernames in the (much smaller) user table, then use the sender/receiver indexes
+        user_ids = User.objects.filter(username__istartswith=search_term).values('id')
+        condition = Q(sender_id__in=user_ids) | Q(receiver_id__in=user_ids)
+        
+        if connections[queryset.db].vendor == 'postgresql':
+            # Same expression as the chat_message_content_search GIN index (migration 0006)
+            condition |= Q(RawSQL(
+                "to_tsvector('simple', coalesce(chat_message.content, '')) @@ plainto_tsquery('simple', %s)",
+                [search_term],
+                output_field=BooleanField()
+            ))
+        else:
+            condition |= Q(content__icontains=search_term)
+        return queryset.filter(condition), False
+    
+    def action_checkbox(self, obj):
+        # The default aria-label is str(obj), which would load the deferred content row by row
+        checkbox = forms.CheckboxInput(
+            {'class': 'action-select', 'aria-label': f'Select message {obj.pk}'},
+            # As upstream: the value is the pk, which must not make the box render checked
+            lambda value: False
+        )
+        return checkbox.render(helpers.ACTION_CHECKBOX_NAME, str(obj.pk))
     
     def content_preview(self, obj):
-        if obj.content:
-            return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+        if obj.content_excerpt:
+            if len(obj.content_excerpt) > CONTENT_PREVIEW_LENGTH:
+                return obj.content_excerpt[:CONTENT_PREVIEW_LENGTH] + '...'
+            return obj.content_excerpt
         elif obj.image:
             return '[Image]'
         elif obj.file:
@@ -21,6 +103,17 @@ class MessageAdmin(admin.ModelAdmin):
     content_preview.short_description = 'Content'
 
 
+@admin.register(ChangeLogEntry)
+class ChangeLogEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'peer', 'kind', 'message_id', 'created_at']
+    list_filter = ['kind']
+    list_select_related = ['user', 'peer']
+    raw_id_fields = ['user', 'peer']
+    readonly_fields = ['created_at']
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
 @admin.register(Friendship)
 class FriendshipAdmin(admin.ModelAdmin):
     list_display = ['from_user', 'to_user', 'status', 'created_at', 'updated_at']
@@ -41,3 +134,40 @@ class BlockedUserAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('blocker', 'blocked')
+
+
+class RoomMembershipInline(admin.TabularInline):
+    model = RoomMembership
+    extra = 0
+    raw_id_fields = ['user']
+    readonly_fields = ['joined_at', 'last_read_message_id']
+
+
+@admin.register(Room)
+class RoomAdmin(admin.ModelAdmin):
+    list_display = ['name', 'created_by', 'created_at', 'last_message_id']
+    search_fields = ['name']
+    readonly_fields = ['created_at', 'last_message_id']
+    inlines = [RoomMembershipInline]
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('created_by')
+
+
+@admin.register(RoomMessage)
+class RoomMessageAdmin(admin.ModelAdmin):
+    list_display = ['room', 'sender', 'content', 'timestamp']
+    list_filter = ['timestamp']
+    search_fields = ['room__name', 'sender__username']
+    readonly_fields = ['timestamp']
+    raw_id_fields = ['room', 'sender']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('room', 'sender')
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_until', 'created_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['created_at']
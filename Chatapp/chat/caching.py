@@ -0,0 +1,68 @@
+"""
+Cache version stamps for rendered fragments.
+
+List pages (user_list, friends_list) are cached per user and keyed by a
+version stamp that is replaced whenever that user's friendships or blocks
+change, or when the set of users changes. Stale fragments are never
+deleted explicitly; they simply stop being looked up and expire.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+
+
+DIRECTORY_VERSION_KEY = 'chat:directory-version'
+
+
+def _relationship_key(user_id):
+    return f'chat:relationship-version:{user_id}'
+
+
+def _new_version():
+    # Time-based so a version lost to eviction is never reissued
+    return time.time_ns()
+
+
+def bump_relationship_version(*user_ids):
+    """Invalidate cached list fragments for the given users"""
+    version = _new_version()
+    cache.set_many({_relationship_key(user_id): version for user_id in user_ids}, None)
+
+
+def bump_directory_version():
+    """Invalidate cached list fragments for every user (a user joined, left or was renamed)"""
+    cache.set(DIRECTORY_VERSION_KEY, _new_version(), None)
+
+
+def list_version(request):
+    """
+    Version string for the current user's cached list fragments.
+
+    Includes the CSRF secret because the cached fragments contain forms.
+    """
+    user_key = _relationship_key(request.user.id)
+    versions = cache.get_many([user_key, DIRECTORY_VERSION_KEY])
+
+    missing = {key: _new_version() for key in (user_key, DIRECTORY_VERSION_KEY) if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            # add() so concurrent requests agree on a single version
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+
+    get_token(request)
+    csrf_secret = request.META.get('CSRF_COOKIE', '')
+    csrf_hash = hashlib.md5(csrf_secret.encode(), usedforsecurity=False).hexdigest()[:12]
+    return f'{versions[user_key]}.{versions[DIRECTORY_VERSION_KEY]}.{csrf_hash}'
+
+
+def list_cache_timeout():
+    return getattr(settings, 'CHAT_LIST_CACHE_SECONDS', 600)
+
+
+def message_cache_timeout():
+    return getattr(settings, 'CHAT_MESSAGE_CACHE_SECONDS', 86400)
@@ -0,0 +1,97 @@
+"""
+Server side of the offline message cache.
+
+Every change a client needs to replay (a new or edited message, a receipt
+status change, a deletion) is appended to the ChangeLogEntry table of each
+affected user. The chat page stores messages in IndexedDB together with the
+last entry id it applied and asks sync_messages for anything newer, so
+reopening a conversation costs one small request instead of a full reload.
+
+Entry ids are allocated when a row is inserted but become visible when its
+transaction commits, so a lower id can show up after a higher one has been
+served. Cursors therefore never move past an entry younger than
+CHAT_SYNC_SETTLE_SECONDS: recent entries are still returned straight away,
+and simply returned again on the next sync until they have settled.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import ChangeLogEntry
+
+
+def snapshot_size():
+    return getattr(settings, 'CHAT_SYNC_SNAPSHOT_MESSAGES', 200)
+
+
+def batch_size():
+    return getattr(settings, 'CHAT_SYNC_BATCH_SIZE', 500)
+
+
+def settle_seconds():
+    return getattr(settings, 'CHAT_SYNC_SETTLE_SECONDS', 5)
+
+
+def _settled_before():
+    return timezone.now() - timedelta(seconds=settle_seconds())
+
+
+def record(kind, message_ids, *participants):
+    """
+    Append `kind` entries for message_ids to the log of each participant.
+
+    participants are (user_id, peer_id) pairs, peer being the other side of
+    the conversation from that user's point of view.
+    """
+    ChangeLogEntry.objects.bulk_create([
+        ChangeLogEntry(user_id=user_id, peer_id=peer_id, kind=kind, message_id=message_id)
+        for user_id, peer_id in participants
+        for message_id in message_ids
+    ])
+
+
+def record_for_conversation(kind, message_ids, sender_id, receiver_id):
+    record(kind, message_ids, (sender_id, receiver_id), (receiver_id, sender_id))
+
+
+def latest_cursor(user_id, peer_id):
+    """Cursor a snapshot read after this call is current as of: just below the first unsettled entry"""
+    entries = ChangeLogEntry.objects.filter(user_id=user_id, peer_id=peer_id)
+    unsettled = entries.filter(created_at__gt=_settled_before()).aggregate(cursor=Min('id'))['cursor']
+    if unsettled is not None:
+        return unsettled - 1
+    return entries.aggregate(cursor=Max('id'))['cursor'] or 0
+
+
+def oldest_cursor():
+    """Lowest entry id still stored; older entries have been trimmed by purge_messages"""
+    return ChangeLogEntry.objects.aggregate(cursor=Min('id'))['cursor'] or 0
+
+
+def changes_since(user_id, peer_id, since):
+    """
+    (changed message ids, deleted message ids, new cursor, more) after `since`.
+
+    Several entries for one message collapse into one; a delete wins. The
+    cursor stops just below the first unsettled entry, and `more` is only
+    set once everything up to the end of the batch has settled.
+    """
+    entries = list(ChangeLogEntry.objects.filter(
+        user_id=user_id, peer_id=peer_id, id__gt=since
+    ).order_by('id').values_list('id', 'kind', 'message_id', 'created_at')[:batch_size() + 1])
+
+    more = len(entries) > batch_size()
+    entries = entries[:batch_size()]
+
+    changed, deleted = set(), set()
+    for _, kind, message_id, _ in entries:
+        (deleted if kind == 'delete' else changed).add(message_id)
+
+    cursor = entries[-1][0] if entries else since
+    settled_before = _settled_before()
+    unsettled = next((entry_id for entry_id, *_, created_at in entries if created_at > settled_before), None)
+    if unsettled is not None:
+        cursor, more = unsettled - 1, False
+    return changed - deleted, deleted, cursor, more
@@ -0,0 +1,163 @@
+"""
+Negotiated encodings for the polling APIs.
+
+Views hand over a table (column names plus row tuples) and the encoding is
+picked from the Accept header:
+
+- application/json (default): the original list-of-objects shape with
+  formatted timestamps
+- application/vnd.chat.columnar+json: column names sent once, rows as
+  arrays, epoch-second timestamps, and low-cardinality string columns
+  replaced by indexes into a per-column table
+- application/x-msgpack: the columnar shape packed with MessagePack
+  (only offered when the optional msgpack package is installed)
+
+Bodies above CHAT_COMPRESS_MIN_BYTES are compressed with brotli (optional
+package) or gzip, following Accept-Encoding.
+
+msgpack and brotli are only imported the first time a response uses them,
+so workers serving JSON polls never load them.
+"""
+import gzip
+import json
+from datetime import datetime
+from functools import lru_cache
+from importlib.util import find_spec
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.chat.columnar+json'
+MSGPACK = 'application/x-msgpack'
+
+LEGACY_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+@lru_cache(maxsize=None)
+def is_installed(module_name):
+    """Whether an optional package can be imported, checked without importing it"""
+    return find_spec(module_name) is not None
+
+
+def available_media_types():
+    types = [JSON, COLUMNAR_JSON]
+    if is_installed('msgpack'):
+        types.append(MSGPACK)
+    return types
+
+
+def _parse_accept(header):
+    """Accept header values ordered by descending q, keeping header order for ties"""
+    accepted = []
+    for index, part in enumerate(header.split(',')):
+        media_type, *params = [piece.strip() for piece in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            accepted.append((-quality, index, media_type.lower()))
+    return [media_type for _, _, media_type in sorted(accepted)]
+
+
+def negotiate_media_type(request):
+    supported = available_media_types()
+    for media_type in _parse_accept(request.headers.get('Accept', '')):
+        if media_type in supported:
+            return media_type
+        if media_type in ('*/*', 'application/*'):
+            return JSON
+    return JSON
+
+
+def negotiate_content_encoding(request):
+    accepted = _parse_accept(request.headers.get('Accept-Encoding', ''))
+    if is_installed('brotli') and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def _legacy_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(LEGACY_TIMESTAMP_FORMAT)
+    return value
+
+
+def _compact_value(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return value
+
+
+def _is_datetime_column(rows, index):
+    for row in rows:
+        if row[index] is not None:
+            return isinstance(row[index], datetime)
+    return False
+
+
+def to_columnar(columns, rows, dictionary_columns=()):
+    """
+    Columnar form of a table:
+    {'columns': [...], 'rows': [[...], ...], 'tables': {column: [values]}, 'epoch': [columns]}
+    """
+    epoch_columns = [name for index, name in enumerate(columns) if _is_datetime_column(rows, index)]
+    rows = [[_compact_value(value) for value in row] for row in rows]
+
+    tables = {}
+    for name in dictionary_columns:
+        index = columns.index(name)
+        lookup = {}
+        for row in rows:
+            row[index] = lookup.setdefault(row[index], len(lookup))
+        tables[name] = list(lookup)
+
+    return {'columns': list(columns), 'rows': rows, 'tables': tables, 'epoch': epoch_columns}
+
+
+def encode_payload(media_type, key, columns, rows, extra=None, dictionary_columns=()):
+    """Serialize a table plus any extra top-level fields to bytes in `media_type`"""
+    extra = extra or {}
+    if media_type == JSON:
+        payload = {key: [dict(zip(columns, map(_legacy_value, row))) for row in rows], **extra}
+        return json.dumps(payload, cls=DjangoJSONEncoder).encode()
+
+    payload = {key: to_columnar(columns, rows, dictionary_columns), **extra}
+    if media_type == MSGPACK:
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def compress(body, content_encoding):
+    if content_encoding == 'br':
+        import brotli
+        return brotli.compress(body, quality=5)
+    if content_encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def table_response(request, key, columns, rows, extra=None, dictionary_columns=()):
+    """HttpResponse for a table in the encoding and compression the client asked for"""
+    media_type = negotiate_media_type(request)
+    body = encode_payload(media_type, key, columns, rows, extra, dictionary_columns)
+
+    content_encoding = None
+    if len(body) >= getattr(settings, 'CHAT_COMPRESS_MIN_BYTES', 1024):
+        content_encoding = negotiate_content_encoding(request)
+        body = compress(body, content_encoding)
+
+    response = HttpResponse(body, content_type=media_type)
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
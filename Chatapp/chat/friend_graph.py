@@ -0,0 +1,140 @@
+"""
+Symmetric view of the friendship graph.
+
+Friendship rows are directed (from_user -> to_user), so listing someone's
+friends needs an OR across both columns. This module caches each user's
+accepted friend ids as a frozenset in the Django cache, fills misses for
+many users in bulk, and is invalidated by the Friendship
+signals (and explicitly by bulk operations that bypass them). Mutual
+friends and suggestions are plain set operations on those sets.
+
+Cached sets are keyed by a per-user version. Invalidating replaces the
+version, so a reader that loaded the old friendships before the change
+committed can only write them under a version nobody looks up any more.
+
+The cache is for display (lists, mutual friends, suggestions). Access
+checks use are_friends/friends_among, which always ask the database.
+"""
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Friendship
+
+
+QUERY_CHUNK_SIZE = 500
+
+
+def _version_key(user_id):
+    return f'chat:friend-ids-version:{user_id}'
+
+
+def _key(user_id, version):
+    return f'chat:friend-ids:{user_id}:{version}'
+
+
+def _timeout():
+    return getattr(settings, 'CHAT_FRIEND_GRAPH_CACHE_SECONDS', 3600)
+
+
+def friend_ids_many(user_ids):
+    """{user_id: frozenset of friend ids} for many users; cache misses are filled in bulk"""
+    user_ids = set(user_ids)
+    # Versions are read before the database so a concurrent invalidation wins
+    stored = cache.get_many([_version_key(user_id) for user_id in user_ids])
+    versions = {user_id: stored.get(_version_key(user_id)) for user_id in user_ids}
+    unversioned = [user_id for user_id, version in versions.items() if version is None]
+    if unversioned:
+        versions.update(_new_versions(unversioned))
+
+    keys = {user_id: _key(user_id, version) for user_id, version in versions.items()}
+    cached = cache.get_many(list(keys.values()))
+    result = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+
+    missing = list(user_ids - result.keys())
+    if missing:
+        adjacency = {user_id: set() for user_id in missing}
+        # Chunked to stay under the database's query parameter limit
+        for start in range(0, len(missing), QUERY_CHUNK_SIZE):
+            chunk = missing[start:start + QUERY_CHUNK_SIZE]
+            edges = Friendship.objects.filter(
+                Q(from_user_id__in=chunk) | Q(to_user_id__in=chunk),
+                status='accepted'
+            ).values_list('from_user_id', 'to_user_id')
+            for from_id, to_id in edges:
+                if from_id in adjacency:
+                    adjacency[from_id].add(to_id)
+                if to_id in adjacency:
+                    adjacency[to_id].add(from_id)
+
+        fresh = {user_id: frozenset(friends) for user_id, friends in adjacency.items()}
+        cache.set_many({keys[user_id]: friends for user_id, friends in fresh.items()}, _timeout())
+        result.update(fresh)
+
+    return result
+
+
+def friend_ids(user_id):
+    return friend_ids_many([user_id])[user_id]
+
+
+def _new_versions(user_ids):
+    # Time-based so a version lost to eviction is never reissued
+    version = time.time_ns()
+    cache.set_many({_version_key(user_id): version for user_id in user_ids}, None)
+    return {user_id: version for user_id in user_ids}
+
+
+def invalidate(*user_ids):
+    """Retire cached friend sets; call once a change to accepted friendships has committed"""
+    _new_versions(user_ids)
+
+
+def friends_among(user_id, candidate_ids):
+    """Which of candidate_ids are friends of user_id, straight from the database"""
+    candidate_ids = list(candidate_ids)
+    friends = set()
+    for from_id, to_id in Friendship.objects.filter(
+        Q(from_user_id=user_id, to_user_id__in=candidate_ids) |
+        Q(from_user_id__in=candidate_ids, to_user_id=user_id),
+        status='accepted'
+    ).values_list('from_user_id', 'to_user_id'):
+        friends.add(to_id if from_id == user_id else from_id)
+    return friends
+
+
+def are_friends(user_id, other_id):
+    return Friendship.objects.filter(
+        Q(from_user_id=user_id, to_user_id=other_id) |
+        Q(from_user_id=other_id, to_user_id=user_id),
+        status='accepted'
+    ).exists()
+
+
+def mutual_friend_ids(user_id, other_id):
+    graph = friend_ids_many([user_id, other_id])
+    return graph[user_id] & graph[other_id]
+
+
+def rank_suggestions(user_id, own_friends, friends_of_friends, excluded=(), limit=10):
+    """
+    People you may know: friends of friends ranked by number of mutual friends.
+
+    friends_of_friends maps each of the user's friends to that friend's set of
+    friends. Returns [(candidate_id, mutual_count), ...].
+    """
+    counts = Counter()
+    for friend_id in own_friends:
+        counts.update(friends_of_friends.get(friend_id, ()))
+
+    for skipped_id in (*own_friends, *excluded, user_id):
+        counts.pop(skipped_id, None)
+    return counts.most_common(limit)
+
+
+def suggestions(user_id, excluded=(), limit=10):
+    own_friends = friend_ids(user_id)
+    return rank_suggestions(user_id, own_friends, friend_ids_many(own_friends), excluded, limit)
@@ -0,0 +1,21 @@
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+
+THUMBNAIL_SIZE = (480, 480)
+
+
+def make_thumbnail(image_file, size=THUMBNAIL_SIZE):
+    """Return a JPEG thumbnail of image_file as a ContentFile"""
+    # Imported here so web workers, which only enqueue thumbnails, never load Pillow
+    from PIL import Image, ImageOps
+
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', quality=80, optimize=True)
+    return ContentFile(buffer.getvalue())
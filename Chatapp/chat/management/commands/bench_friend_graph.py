@@ -0,0 +1,144 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from chat import friend_graph
+from chat.models import Friendship
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark friend listing, mutual friends and suggestions through chat.friend_graph '
+        'against the directed OR query, on a synthetic graph seeded into the database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000, help='Number of users in the graph')
+        parser.add_argument('--avg-degree', type=int, default=20, help='Average number of friends per user')
+        parser.add_argument('--samples', type=int, default=500, help='Queries timed per operation')
+        parser.add_argument('--page-size', type=int, default=50, help='Users per friend_ids_many call')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        user_ids = []
+        try:
+            # Everything is rolled back at the end, leaving the database as it was
+            with transaction.atomic():
+                user_ids = self.seed(rng, options['users'], options['avg_degree'])
+                self.run(rng, user_ids, options['samples'], options['page_size'])
+                transaction.set_rollback(True)
+        finally:
+            # Rolled back ids can be handed out again, so their cached sets must go too
+            friend_graph.invalidate(*user_ids)
+
+    def seed(self, rng, users, avg_degree):
+        self.stdout.write(f'Seeding {users} users with ~{avg_degree} friends each...')
+        start = time.perf_counter()
+        created = User.objects.bulk_create(
+            [User(username=f'bench-friend-graph-{index}', password='!') for index in range(users)],
+            batch_size=5000,
+        )
+        user_ids = [user.id for user in created]
+        edges = self.generate_edges(rng, users, avg_degree)
+        Friendship.objects.bulk_create(
+            (Friendship(from_user_id=user_ids[a], to_user_id=user_ids[b], status='accepted') for a, b in edges),
+            batch_size=5000,
+        )
+        self.stdout.write(f'{len(edges)} directed Friendship rows in {time.perf_counter() - start:.1f} s\n')
+        return user_ids
+
+    def run(self, rng, user_ids, samples, page_size):
+        sample_users = [rng.choice(user_ids) for _ in range(samples)]
+        pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(samples)]
+        pages = [rng.sample(user_ids, page_size) for _ in range(max(samples // 10, 20))]
+
+        def cold(ids):
+            friend_graph.invalidate(*ids)
+
+        def cold_with_friends(user_id):
+            cold([user_id, *self.or_query(user_id)])
+
+        self.stdout.write(f"{'operation':<48} {'p50 ms':>10} {'p95 ms':>10} {'queries':>8}")
+        self.report('friends: OR query', self.time_each(sample_users, self.or_query))
+        self.report('friends: friend_ids, cold cache', self.time_each(
+            sample_users, friend_graph.friend_ids, before=lambda user_id: cold([user_id])
+        ))
+        self.report('friends: friend_ids, warm cache', self.time_each(sample_users, friend_graph.friend_ids))
+
+        self.report(f'{page_size} users: OR query each', self.time_each(
+            pages, lambda page: [self.or_query(user_id) for user_id in page]
+        ))
+        self.report(f'{page_size} users: friend_ids_many, cold cache', self.time_each(
+            pages, friend_graph.friend_ids_many, before=cold
+        ))
+        self.report(f'{page_size} users: friend_ids_many, warm cache', self.time_each(
+            pages, friend_graph.friend_ids_many
+        ))
+
+        self.report('mutual friends: two OR queries', self.time_each(
+            pairs, lambda pair: self.or_query(pair[0]) & self.or_query(pair[1])
+        ))
+        self.report('mutual friends: mutual_friend_ids, cold cache', self.time_each(
+            pairs, lambda pair: friend_graph.mutual_friend_ids(*pair), before=cold
+        ))
+        self.report('mutual friends: mutual_friend_ids, warm cache', self.time_each(
+            pairs, lambda pair: friend_graph.mutual_friend_ids(*pair)
+        ))
+
+        self.report('suggestions: OR query per friend', self.time_each(sample_users, self.or_query_suggestions))
+        self.report('suggestions: suggestions(), cold cache', self.time_each(
+            sample_users, friend_graph.suggestions, before=cold_with_friends
+        ))
+        self.report('suggestions: suggestions(), warm cache', self.time_each(
+            sample_users, friend_graph.suggestions
+        ))
+
+    def or_query(self, user_id):
+        """The uncached lookup friend_graph replaced"""
+        friendships = Friendship.objects.filter(
+            Q(from_user_id=user_id, status='accepted') |
+            Q(to_user_id=user_id, status='accepted')
+        ).values_list('from_user_id', 'to_user_id')
+        return {from_id if from_id != user_id else to_id for from_id, to_id in friendships}
+
+    def or_query_suggestions(self, user_id):
+        own_friends = self.or_query(user_id)
+        return friend_graph.rank_suggestions(
+            user_id, own_friends, {friend_id: self.or_query(friend_id) for friend_id in own_friends}
+        )
+
+    def generate_edges(self, rng, users, avg_degree):
+        edges = set()
+        target = users * avg_degree // 2
+        while len(edges) < target:
+            a, b = rng.randrange(users), rng.randrange(users)
+            if a != b and (b, a) not in edges:
+                edges.add((a, b))
+        return list(edges)
+
+    def time_each(self, items, func, before=None):
+        """(seconds per call, database queries per call)"""
+        times, queries = [], []
+        for item in items:
+            if before is not None:
+                before(item)
+            executed = []
+            # A warm run that still queries means the cache evicted entries
+            with connection.execute_wrapper(lambda execute, *args: executed.append(1) or execute(*args)):
+                start = time.perf_counter()
+                func(item)
+                times.append(time.perf_counter() - start)
+            queries.append(len(executed))
+        return times, queries
+
+    def report(self, label, measured):
+        times, queries = measured
+        p50 = statistics.median(times) * 1000
+        p95 = statistics.quantiles(times, n=20)[-1] * 1000 if len(times) >= 20 else max(times) * 1000
+        self.stdout.write(f'{label:<48} {p50:>10.3f} {p95:>10.3f} {statistics.mean(queries):>8.1f}')
@@ -0,0 +1,71 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat import encoding
+from chat.views import MESSAGE_COLUMNS
+
+
+class Command(BaseCommand):
+    help = 'Compare serialization CPU time and response size of the polling API encodings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help='Messages per payload')
+        parser.add_argument('--repeat', type=int, default=50, help='Encodings timed per format')
+
+    def handle(self, *args, **options):
+        rows = self.sample_rows(options['messages'])
+        extra = {'presence': {'online': True, 'last_seen': 1700000000}, 'typing': False, 'poll_interval': 2000}
+
+        media_types = encoding.available_media_types()
+        content_encodings = [None, 'gzip'] + (['br'] if encoding.is_installed('brotli') else [])
+        if not encoding.is_installed('msgpack'):
+            self.stdout.write('msgpack not installed; skipping application/x-msgpack')
+        if not encoding.is_installed('brotli'):
+            self.stdout.write('brotli not installed; skipping br')
+
+        self.stdout.write(f"{options['messages']} messages, {options['repeat']} runs each\n")
+        self.stdout.write(f"{'encoding':<40} {'compression':<12} {'bytes':>10} {'ms/encode':>10}")
+        baseline = None
+        for media_type in media_types:
+            for content_encoding in content_encodings:
+                start = time.process_time()
+                for _ in range(options['repeat']):
+                    body = encoding.encode_payload(
+                        media_type, 'messages', MESSAGE_COLUMNS, rows, extra,
+                        dictionary_columns=('sender', 'status')
+                    )
+                    body = encoding.compress(body, content_encoding)
+                elapsed_ms = (time.process_time() - start) * 1000 / options['repeat']
+                baseline = baseline or len(body)
+                self.stdout.write(
+                    f"{media_type:<40} {content_encoding or 'none':<12} {len(body):>10} {elapsed_ms:>10.2f}"
+                    f"  ({len(body) / baseline:.0%} of plain JSON)"
+                )
+
+    def sample_rows(self, count):
+        """Conversation-shaped rows: two senders, mostly text, a few attachments"""
+        rng = random.Random(42)
+        words = 'hey hello ok sure thanks see you tomorrow lunch meeting call later sounds good'.split()
+        start = timezone.now() - timedelta(days=7)
+        rows = []
+        for index in range(count):
+            is_sender = rng.random() < 0.5
+            attachment = rng.random() < 0.05
+            rows.append((
+                index + 1,
+                'alice' if is_sender else 'bob',
+                ' '.join(rng.choice(words) for _ in range(rng.randint(1, 12))),
+                start + timedelta(seconds=index * 37),
+                is_sender,
+                rng.choice(['sent', 'delivered', 'read', 'read', 'read']),
+                f'/media/chat_images/photo_{index}.jpg' if attachment else None,
+                f'/media/chat_thumbnails/photo_{index}.jpg' if attachment else None,
+                None,
+                None,
+                start + timedelta(days=1, seconds=index * 37) if rng.random() < 0.1 else None,
+            ))
+        return rows
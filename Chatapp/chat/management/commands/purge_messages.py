@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import retention
+
+
+class Command(BaseCommand):
+    help = 'Delete expired messages, messages past the retention period and old sync changelog entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'CHAT_PURGE_BATCH_SIZE', 1000),
+                            help='Rows deleted per transaction')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop each pass after this many batches (default: until done)')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches so other writers can get the lock')
+
+    def handle(self, *args, **options):
+        results = retention.purge(options['batch_size'], options['max_batches'], options['pause'])
+
+        self.stdout.write(f"{'pass':<32} {'rows':>10} {'files':>8} {'batches':>8} {'rows/s':>10} {'max batch ms':>13}")
+        for stats in results:
+            self.stdout.write(
+                f'{stats.label:<32} {stats.rows:>10} {stats.files:>8} {stats.batches:>8} '
+                f'{stats.rows_per_second:>10.0f} {stats.slowest_batch * 1000:>13.1f}'
+            )
+        files = sum(stats.files for stats in results)
+        if files:
+            self.stdout.write(f'{files} attachment files queued for deletion (run_tasks removes them)')
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat import tasks  # noqa: F401  (registers the task functions)
+from chat.taskqueue import make_executor, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (thumbnails and other deferred work)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'CHAT_TASK_WORKERS', 4),
+                            help='Number of worker threads')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Tasks claimed per polling round')
+        parser.add_argument('--visibility-timeout', type=int,
+                            default=getattr(settings, 'CHAT_TASK_VISIBILITY_TIMEOUT', 300),
+                            help='Seconds before a claimed but unfinished task is handed out again')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        executor = make_executor(options['workers'])
+        total = 0
+        self.stdout.write(f"Task worker started with {options['workers']} threads")
+        try:
+            while True:
+                count = run_pending(executor, options['batch_size'], options['visibility_timeout'])
+                total += count
+                if count == 0:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            executor.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f'Processed {total} tasks'))
@@ -0,0 +1,114 @@
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Runs in a fresh interpreter so every import is a cold one
+CHILD_SCRIPT = '''
+import glob, json, os, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+
+from django.apps import apps
+from django.urls import get_resolver
+get_resolver().reverse_dict
+urls_done = time.perf_counter()
+
+from django.template.loader import get_template
+template_dir = os.path.join(apps.get_app_config('chat').path, 'templates')
+names = [os.path.relpath(path, template_dir) for path in glob.glob(os.path.join(template_dir, 'chat', '*.html'))]
+for name in names:
+    get_template(name)
+templates_done = time.perf_counter()
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps({
+    'setup': setup_done - started,
+    'urls': urls_done - setup_done,
+    'templates': templates_done - urls_done,
+    'template_count': len(names),
+    'rss_kb': rss_kb(),
+    'modules': len(sys.modules),
+    'loaded': [name for name in %(watched)r if name in sys.modules],
+}))
+'''
+
+# Optional or heavy modules whose presence after startup is worth knowing about
+WATCHED_MODULES = ('PIL', 'PIL.Image', 'msgpack', 'brotli')
+
+
+class Command(BaseCommand):
+    help = 'Measure cold start: import time per package, URLconf and template load time, and RSS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts to measure (medians are reported)')
+        parser.add_argument('--top', type=int, default=15, help='Packages to list in the import breakdown')
+
+    def handle(self, *args, **options):
+        runs = [self.cold_start() for _ in range(max(options['runs'], 1))]
+        reports = [report for report, _ in runs]
+
+        def median(key):
+            return statistics.median(report[key] for report in reports)
+
+        if sys.flags.dont_write_bytecode:
+            self.stdout.write(self.style.WARNING(
+                'PYTHONDONTWRITEBYTECODE is set: import times include compiling every module from source'
+            ))
+        self.stdout.write(f"Cold start, median of {len(runs)} runs (python -X importtime)\n")
+        self.stdout.write(f"  django.setup() (settings, apps, models)  {median('setup') * 1000:8.1f} ms")
+        self.stdout.write(f"  URLconf import and resolver              {median('urls') * 1000:8.1f} ms")
+        self.stdout.write(
+            f"  templates ({reports[0]['template_count']} in chat/)                  {median('templates') * 1000:8.1f} ms"
+        )
+        self.stdout.write(f"  resident memory                          {median('rss_kb') / 1024:8.1f} MB")
+        self.stdout.write(f"  modules loaded                           {median('modules'):8.0f}")
+        self.stdout.write(f"  watched modules loaded: {', '.join(reports[0]['loaded']) or 'none'}\n")
+
+        per_package = defaultdict(list)
+        for _, imports in runs:
+            for package, micros in imports.items():
+                per_package[package].append(micros)
+        totals = {package: statistics.median(values) for package, values in per_package.items()}
+
+        self.stdout.write(f"{'package':<28} {'import ms':>10}")
+        for package, micros in sorted(totals.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'{package:<28} {micros / 1000:>10.1f}')
+        self.stdout.write(f"{'total':<28} {sum(totals.values()) / 1000:>10.1f}")
+
+    def cold_start(self):
+        """Run the startup in a new interpreter; returns (timings, {top-level package: self import us})"""
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT % {'watched': WATCHED_MODULES}],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Startup failed:\n{result.stderr[-2000:]}')
+
+        imports = defaultdict(int)
+        for line in result.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, _, module = line[len('import time:'):].split('|')
+            imports[module.strip().split('.')[0]] += int(self_us)
+        return json.loads(result.stdout.strip().splitlines()[-1]), imports
@@ -0,0 +1,171 @@
+"""
+In-process metrics registry for the chat app.
+
+Collects per-view histograms (request time, query count, DB time, template
+render time, payload size) and renders them in the Prometheus text format.
+"""
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+
+# Default bucket boundaries
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Cumulative histogram keyed by a label value (the view name)"""
+
+    def __init__(self, name, help_text, buckets, label='view'):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # One slot per bucket plus +Inf, then sum
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+
+        lines = []
+        for label_value, series in sorted(snapshot.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{_format(bound)}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {_format(series[-1])}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram'] + self.samples()
+
+
+class Counter:
+    """Monotonic counter keyed by a label value"""
+
+    def __init__(self, name, help_text, label='view'):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        with self._lock:
+            snapshot = dict(self._values)
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_value, value in sorted(snapshot.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_format(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS, label='view'):
+        return self._register(Histogram(name, help_text, buckets, label))
+
+    def counter(self, name, help_text, label='view'):
+        return self._register(Counter(name, help_text, label))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'chat_request_duration_seconds', 'Wall-clock time spent handling the request.')
+db_queries = registry.histogram(
+    'chat_db_queries', 'Number of SQL queries executed per request.', COUNT_BUCKETS)
+db_duration = registry.histogram(
+    'chat_db_duration_seconds', 'Time spent executing SQL per request.')
+template_duration = registry.histogram(
+    'chat_template_render_seconds', 'Time spent rendering templates per request.')
+response_size = registry.histogram(
+    'chat_response_bytes', 'Size of the response body in bytes.', SIZE_BUCKETS)
+slow_requests = registry.counter(
+    'chat_slow_requests_total', 'Requests slower than CHAT_SLOW_REQUEST_MS.')
+
+
+class RequestStats:
+    """Per-request accumulator filled in by the DB execute wrapper and template backend"""
+
+    __slots__ = ('query_count', 'db_time', 'template_time', 'queries')
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = perf_counter() - start
+            self.query_count += 1
+            self.db_time += elapsed
+            self.queries.append((elapsed, sql))
+
+
+_current_stats = ContextVar('chat_request_stats', default=None)
+
+
+def current_request_stats():
+    """Return the RequestStats for the request being handled, or None"""
+    return _current_stats.get()
+
+
+def activate(stats):
+    return _current_stats.set(stats)
+
+
+def deactivate(token):
+    _current_stats.reset(token)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
@@ -0,0 +1,103 @@
+import logging
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware as DjangoSessionMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+
+logger = logging.getLogger('chat.metrics')
+
+
+class RequestMetricsMiddleware:
+    """
+    Record per-view query count, DB time, template render time and payload
+    size, and log slow requests together with their slowest SQL.
+
+    Disabled unless CHAT_METRICS_ENABLED is set, in which case Django drops
+    the middleware from the chain entirely.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CHAT_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request_seconds = getattr(settings, 'CHAT_SLOW_REQUEST_MS', 500) / 1000
+        self.slow_query_limit = getattr(settings, 'CHAT_SLOW_REQUEST_QUERIES', 10)
+
+    def __call__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.activate(stats)
+        start = perf_counter()
+        try:
+            with _wrap_all_connections(stats):
+                response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        elapsed = perf_counter() - start
+
+        self.record(request, response, stats, elapsed)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+
+        metrics.request_duration.observe(view, elapsed)
+        metrics.db_queries.observe(view, stats.query_count)
+        metrics.db_duration.observe(view, stats.db_time)
+        metrics.template_duration.observe(view, stats.template_time)
+        if not response.streaming:
+            metrics.response_size.observe(view, len(response.content))
+
+        if elapsed >= self.slow_request_seconds:
+            metrics.slow_requests.inc(view)
+            slowest = sorted(stats.queries, key=lambda query: query[0], reverse=True)[:self.slow_query_limit]
+            logger.warning(
+                'Slow request %s %s (%s) took %.1fms: %d queries in %.1fms, templates %.1fms\n%s',
+                request.method, request.path, view, elapsed * 1000,
+                stats.query_count, stats.db_time * 1000, stats.template_time * 1000,
+                '\n'.join(f'  {duration * 1000:.1f}ms  {sql}' for duration, sql in slowest),
+            )
+
+
+def _wrap_all_connections(stats):
+    """Install the stats execute wrapper on every configured database connection"""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(stats))
+    return stack
+
+
+def skip_session_save(view_func):
+    """
+    Mark a background endpoint (heartbeats, polling) whose requests should
+    not re-save the session. Apply it outermost, above login_required.
+    """
+    view_func.skip_session_save = True
+    return view_func
+
+
+class SessionMiddleware(DjangoSessionMiddleware):
+    """
+    SessionMiddleware that ignores SESSION_SAVE_EVERY_REQUEST for views
+    marked with @skip_session_save, so an open tab's heartbeat and polling
+    never write the session table. Sessions those views actually modify are
+    still saved; page loads and message sends keep extending expiry.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'skip_session_save', False):
+            request.skip_session_save = True
+
+    def process_response(self, request, response):
+        if getattr(request, 'skip_session_save', False) and not request.session.modified:
+            if request.session.accessed:
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return super().process_response(request, response)
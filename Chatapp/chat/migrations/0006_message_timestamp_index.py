@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+# Full-text index used by the admin message search; PostgreSQL only. The
+# expression must match the one in MessageAdmin.get_search_results.
+CREATE_CONTENT_SEARCH_INDEX = (
+    "CREATE INDEX IF NOT EXISTS chat_message_content_search "
+    "ON chat_message USING gin (to_tsvector('simple', coalesce(content, '')))"
+)
+DROP_CONTENT_SEARCH_INDEX = 'DROP INDEX IF EXISTS chat_message_content_search'
+
+
+def create_content_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_CONTENT_SEARCH_INDEX)
+
+
+def drop_content_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_CONTENT_SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_rooms'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(create_content_search_index, drop_content_search_index),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Friendship(models.Model):
@@ -46,18 +47,22 @@ class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
     content = models.TextField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
     is_read = models.BooleanField(default=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='sent')
     
     # File attachments
     image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
+    thumbnail = models.ImageField(upload_to='chat_thumbnails/', blank=True, null=True)
     file = models.FileField(upload_to='chat_files/', blank=True, null=True)
     file_name = models.CharField(max_length=255, blank=True, null=True)
     
     # Timestamps for status tracking
     delivered_at = models.DateTimeField(blank=True, null=True)
     read_at = models.DateTimeField(blank=True, null=True)
+    
+    # Disappearing messages: hidden once passed, deleted by `manage.py purge_messages`
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True)
 
     class Meta:
         ordering = ['timestamp']
@@ -70,3 +75,124 @@ class Message(models.Model):
         elif self.file:
             return f'{self.sender.username} sent a file to {self.receiver.username}'
         return f'{self.sender.username} to {self.receiver.username}'
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Per-user, per-conversation sequence of message changes. Clients keep
+    the highest id they have applied and ask for everything after it.
+    """
+    KIND_CHOICES = [
+        ('message', 'Message'),
+        ('status', 'Status'),
+        ('delete', 'Delete'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='changelog')
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Not a foreign key: entries must outlive deleted messages, and bulk
+    # message deletes should not have to cascade into the log
+    message_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['user', 'peer', 'id']),
+        ]
+    
+    def __str__(self):
+        return f'#{self.id} {self.kind} message {self.message_id} for user {self.user_id}'
+
+
+class Room(models.Model):
+    """Group conversation; each message is stored once per room"""
+    name = models.CharField(max_length=100)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='created_rooms')
+    members = models.ManyToManyField(User, through='RoomMembership', related_name='chat_rooms')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    # Highest RoomMessage id in the room, kept so listings can tell unread rooms apart without a join
+    last_message_id = models.BigIntegerField(default=0)
+    
+    # Lifetime of new messages in the room; empty keeps them
+    message_ttl = models.DurationField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-last_message_id']
+    
+    def __str__(self):
+        return self.name
+
+
+class RoomMembership(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='room_memberships')
+    is_admin = models.BooleanField(default=False)
+    joined_at = models.DateTimeField(auto_now_add=True)
+    
+    # Read cursor: every message with id <= last_read_message_id has been read by this member
+    last_read_message_id = models.BigIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('room', 'user')
+    
+    def __str__(self):
+        return f'{self.user.username} in {self.room.name}'
+
+
+class RoomMessage(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_room_messages')
+    content = models.TextField(blank=True, null=True)
+    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    # File attachments
+    image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
+    file = models.FileField(upload_to='chat_files/', blank=True, null=True)
+    file_name = models.CharField(max_length=255, blank=True, null=True)
+    
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['room', 'id']),
+        ]
+    
+    def __str__(self):
+        return f'{self.sender.username} in {self.room.name}: {(self.content or "")[:50]}'
+
+
+class Task(models.Model):
+    """Deferred work picked up by the run_tasks worker command"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    
+    # Not picked up before run_after; a running task whose locked_until has
+    # passed is assumed lost and handed to another worker
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['status', 'locked_until']),
+        ]
+    
+    def __str__(self):
+        return f'{self.name} ({self.status}, attempt {self.attempts}/{self.max_attempts})'
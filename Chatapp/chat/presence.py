@@ -0,0 +1,129 @@
+"""
+Online / last-seen presence and typing indicators.
+
+Presence is kept in a TTL key-value store, never in the database: a
+heartbeat stores the user's last-seen time, and typing notifications are
+short-lived keys. The default store lives in process memory; set
+CHAT_PRESENCE_STORE = 'cache' to share presence between workers through
+the Django cache. Lookups for many users are a single get_many().
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class MemoryTTLStore:
+    """Per-process dict of key -> (value, expires_at)"""
+
+    prune_every = 60
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + ttl)
+            if now - self._last_prune > self.prune_every:
+                self._data = {k: item for k, item in self._data.items() if item[1] > now}
+                self._last_prune = now
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is not None and item[1] > now:
+                    found[key] = item[0]
+        return found
+
+
+class CacheTTLStore:
+    """Shared store backed by the Django cache"""
+
+    prefix = 'chat:presence:'
+
+    def set(self, key, value, ttl):
+        cache.set(self.prefix + key, value, ttl)
+
+    def delete(self, key):
+        cache.delete(self.prefix + key)
+
+    def get_many(self, keys):
+        found = cache.get_many([self.prefix + key for key in keys])
+        return {key[len(self.prefix):]: value for key, value in found.items()}
+
+
+_memory_store = MemoryTTLStore()
+_cache_store = CacheTTLStore()
+
+# Conversation keys: 'u<user id>' for a direct chat, 'r<room id>' for a group
+CONVERSATION_KEY_RE = re.compile(r'^[ur]\d+$')
+
+
+def get_store():
+    if getattr(settings, 'CHAT_PRESENCE_STORE', 'memory') == 'cache':
+        return _cache_store
+    return _memory_store
+
+
+def heartbeat_interval_ms():
+    """How often the client should send heartbeats"""
+    return getattr(settings, 'CHAT_PRESENCE_HEARTBEAT_SECONDS', 20) * 1000
+
+
+def _seen_key(user_id):
+    return f'seen:{user_id}'
+
+
+def _typing_key(user_id, conversation):
+    return f'typing:{user_id}:{conversation}'
+
+
+def heartbeat(user_id, typing_in=None):
+    """Record that a user is online and, optionally, typing in a conversation"""
+    store = get_store()
+    store.set(_seen_key(user_id), time.time(), getattr(settings, 'CHAT_PRESENCE_LAST_SEEN_SECONDS', 604800))
+    if typing_in:
+        store.set(_typing_key(user_id, typing_in), True, getattr(settings, 'CHAT_PRESENCE_TYPING_SECONDS', 6))
+
+
+def stop_typing(user_id, conversation):
+    get_store().delete(_typing_key(user_id, conversation))
+
+
+def presence_for(user_ids):
+    """
+    Presence of many users in one lookup:
+    {user_id: {'online': bool, 'last_seen': epoch seconds or None}}
+    """
+    user_ids = list(user_ids)
+    seen = get_store().get_many([_seen_key(user_id) for user_id in user_ids])
+    online_window = getattr(settings, 'CHAT_PRESENCE_ONLINE_SECONDS', 45)
+    now = time.time()
+
+    presence = {}
+    for user_id in user_ids:
+        last_seen = seen.get(_seen_key(user_id))
+        presence[user_id] = {
+            'online': last_seen is not None and now - last_seen <= online_window,
+            'last_seen': int(last_seen) if last_seen is not None else None,
+        }
+    return presence
+
+
+def typing_users(conversation, user_ids):
+    """Ids of the given users currently typing in a conversation"""
+    user_ids = list(user_ids)
+    typing = get_store().get_many([_typing_key(user_id, conversation) for user_id in user_ids])
+    return [user_id for user_id in user_ids if _typing_key(user_id, conversation) in typing]
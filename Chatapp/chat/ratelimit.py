@@ -0,0 +1,201 @@
+"""
+Token-bucket rate limiting for the send and polling endpoints.
+
+Each (scope, user) pair owns a bucket that refills at a steady rate up to a
+burst size. Buckets live in process memory by default, or in the Django
+cache (CHAT_RATE_LIMIT_STORE = 'cache') so several workers share them.
+A server-wide bucket per scope measures overall load and is used to advise
+polling clients how long to wait before their next request.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+
+DEFAULT_RATE_LIMITS = {
+    # scope: (tokens per second, burst)
+    'send': (1.0, 10),
+    'poll': (1.0, 10),
+    'notifications': (0.5, 5),
+    'presence': (1.0, 10),
+    'friends': (0.2, 5),
+}
+
+DEFAULT_SERVER_BUDGETS = {
+    # scope: (requests per second, burst) across all users before clients are told to back off
+    'poll': (200.0, 400),
+    'notifications': (100.0, 200),
+}
+
+
+class Decision:
+    __slots__ = ('allowed', 'tokens', 'capacity', 'retry_after')
+
+    def __init__(self, allowed, tokens, capacity, retry_after):
+        self.allowed = allowed
+        self.tokens = tokens
+        self.capacity = capacity
+        self.retry_after = retry_after
+
+    @property
+    def fill(self):
+        """Fraction of the bucket still available, 0.0 - 1.0"""
+        return self.tokens / self.capacity if self.capacity else 1.0
+
+
+def _refill(state, rate, capacity, now):
+    if state is None:
+        return float(capacity)
+    tokens, updated_at = state
+    return min(float(capacity), tokens + (now - updated_at) * rate)
+
+
+def _take(tokens, rate, capacity, cost):
+    if tokens >= cost:
+        return Decision(True, tokens - cost, capacity, 0.0), tokens - cost
+    retry_after = (cost - tokens) / rate if rate else float('inf')
+    return Decision(False, tokens, capacity, retry_after), tokens
+
+
+class MemoryBucketStore:
+    """Buckets held in a dict; limits apply per worker process"""
+
+    max_idle = 3600
+    prune_every = 60
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def consume(self, key, rate, capacity, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            tokens = _refill(self._buckets.get(key), rate, capacity, now)
+            decision, tokens = _take(tokens, rate, capacity, cost)
+            self._buckets[key] = (tokens, now)
+            if now - self._last_prune > self.prune_every:
+                self._prune(now)
+        return decision
+
+    def _prune(self, now):
+        # Drop buckets idle long enough to have refilled completely
+        stale = [key for key, (_, updated_at) in self._buckets.items() if now - updated_at > self.max_idle]
+        for key in stale:
+            del self._buckets[key]
+        self._last_prune = now
+
+
+class CacheBucketStore:
+    """
+    Buckets held in the Django cache so all workers share them.
+
+    Read-modify-write is not atomic, so concurrent requests may occasionally
+    both succeed on the last token; the limit is approximate by design.
+    """
+
+    def __init__(self, prefix='chat:ratelimit:'):
+        self.prefix = prefix
+
+    def consume(self, key, rate, capacity, cost=1):
+        now = time.time()
+        cache_key = self.prefix + key
+        tokens = _refill(cache.get(cache_key), rate, capacity, now)
+        decision, tokens = _take(tokens, rate, capacity, cost)
+        # Expire once the bucket would be full again anyway
+        timeout = math.ceil((capacity - tokens) / rate) + 1 if rate else None
+        cache.set(cache_key, (tokens, now), timeout)
+        return decision
+
+
+_memory_store = MemoryBucketStore()
+_cache_store = CacheBucketStore()
+
+
+def get_store():
+    if getattr(settings, 'CHAT_RATE_LIMIT_STORE', 'memory') == 'cache':
+        return _cache_store
+    return _memory_store
+
+
+def _limits(scope):
+    limits = getattr(settings, 'CHAT_RATE_LIMITS', DEFAULT_RATE_LIMITS)
+    return limits.get(scope, DEFAULT_RATE_LIMITS.get(scope))
+
+
+def _server_budget(scope):
+    budgets = getattr(settings, 'CHAT_SERVER_POLL_BUDGETS', DEFAULT_SERVER_BUDGETS)
+    return budgets.get(scope)
+
+
+def rate_limit(scope, methods=None, json=True):
+    """
+    Limit a view to the CHAT_RATE_LIMITS[scope] bucket of the requesting user.
+
+    Only requests whose method is in `methods` are counted (all when None).
+    Rejected requests get a 429 with Retry-After. The decision is stored on
+    request.rate_limit for suggested_poll_interval().
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            limits = _limits(scope)
+            if limits is None or (methods and request.method not in methods):
+                return view_func(request, *args, **kwargs)
+
+            rate, burst = limits
+            store = get_store()
+            decision = store.consume(f'{scope}:{request.user.pk}', rate, burst)
+            request.rate_limit = decision
+
+            budget = _server_budget(scope)
+            if budget:
+                request.server_load = store.consume(f'{scope}:*', *budget)
+
+            if not decision.allowed:
+                return too_many_requests(decision.retry_after, json=json)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def too_many_requests(retry_after, json=True):
+    retry_after = max(1, math.ceil(retry_after))
+    if json:
+        response = JsonResponse({'error': 'rate_limited', 'retry_after': retry_after}, status=429)
+    else:
+        response = HttpResponse(
+            'Too many requests. Please wait a moment and try again.',
+            status=429, content_type='text/plain'
+        )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def suggested_poll_interval(request, base=None):
+    """
+    Milliseconds the client should wait before polling again.
+
+    Stays at `base` (default CHAT_POLL_INTERVAL_MS) while the user's own bucket and the
+    server-wide budget are at least half full, then stretches towards
+    CHAT_POLL_INTERVAL_MAX_MS as either drains.
+    """
+    if base is None:
+        base = getattr(settings, 'CHAT_POLL_INTERVAL_MS', 2000)
+    maximum = getattr(settings, 'CHAT_POLL_INTERVAL_MAX_MS', 30000)
+
+    fill = 1.0
+    for decision in (getattr(request, 'rate_limit', None), getattr(request, 'server_load', None)):
+        if decision is not None:
+            fill = min(fill, decision.fill)
+
+    if fill >= 0.5:
+        return base
+    if fill <= 0:
+        return maximum
+    return int(min(maximum, base * 0.5 / fill))
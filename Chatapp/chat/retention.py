@@ -0,0 +1,165 @@
+"""
+Disappearing messages and retention policies.
+
+Messages carry an optional expires_at (chosen per message in direct chats,
+derived from Room.message_ttl in groups). Expired messages are hidden from
+every read path straight away and deleted later by
+`python manage.py purge_messages`, which also enforces
+CHAT_MESSAGE_RETENTION_DAYS and trims the sync changelog.
+
+Deletes run in short transactions of at most `batch_size` rows so SQLite's
+single writer lock is never held for long. Message deletes are plain
+DELETE ... WHERE id IN (...) statements (nothing cascades from Message and
+no signals listen to it), each paired with 'delete' changelog entries so
+offline clients drop the messages too. Attachment files are removed
+afterwards by the delete_files task.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChangeLogEntry, Message, RoomMessage
+from .tasks import delete_files
+
+
+DEFAULT_TTL_CHOICES = [
+    # (seconds, label); 0 keeps messages
+    (0, 'Off'),
+    (3600, '1 hour'),
+    (86400, '1 day'),
+    (604800, '1 week'),
+]
+
+
+def ttl_choices():
+    return getattr(settings, 'CHAT_MESSAGE_TTL_CHOICES', DEFAULT_TTL_CHOICES)
+
+
+def ttl_from_post(value):
+    """timedelta for a submitted TTL choice, or None when off or not one of the offered choices"""
+    try:
+        seconds = int(value)
+    except (TypeError, ValueError):
+        return None
+    if seconds <= 0 or seconds not in dict(ttl_choices()):
+        return None
+    return timedelta(seconds=seconds)
+
+
+def live():
+    """Q matching messages that have not expired"""
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+
+
+class PurgeStats:
+    def __init__(self, label):
+        self.label = label
+        self.rows = 0
+        self.files = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.slowest_batch = 0.0
+
+    def add_batch(self, rows, files, seconds):
+        self.rows += rows
+        self.files += files
+        self.batches += 1
+        self.seconds += seconds
+        self.slowest_batch = max(self.slowest_batch, seconds)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _batches(queryset, fields, batch_size, max_batches, pause):
+    """
+    Yield up to batch_size row tuples matching queryset until none are left.
+
+    The caller deletes each batch before asking for the next, so the same
+    query keeps returning fresh rows. pause (seconds) lets other writers in
+    between batches.
+    """
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = list(queryset.values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        batches += 1
+        if pause:
+            time.sleep(pause)
+
+
+def _delete_files_later(names):
+    names = [name for name in names if name]
+    if names:
+        delete_files.delay(names=names)
+    return len(names)
+
+
+def purge_messages(condition, label, batch_size, max_batches=None, pause=0.0):
+    stats = PurgeStats(label)
+    # order_by() drops Meta.ordering so the LIMIT can stop at the first matching index entries
+    queryset = Message.objects.filter(condition).order_by()
+    fields = ('id', 'sender_id', 'receiver_id', 'image', 'thumbnail', 'file')
+    for rows in _batches(queryset, fields, batch_size, max_batches, pause):
+        start = time.perf_counter()
+        with transaction.atomic():
+            Message.objects.filter(id__in=[row[0] for row in rows]).delete()
+            ChangeLogEntry.objects.bulk_create([
+                ChangeLogEntry(user_id=user_id, peer_id=peer_id, kind='delete', message_id=message_id)
+                for message_id, sender_id, receiver_id, *_ in rows
+                for user_id, peer_id in ((sender_id, receiver_id), (receiver_id, sender_id))
+            ])
+            files = _delete_files_later([name for row in rows for name in row[3:]])
+        stats.add_batch(len(rows), files, time.perf_counter() - start)
+    return stats
+
+
+def purge_room_messages(condition, label, batch_size, max_batches=None, pause=0.0):
+    stats = PurgeStats(label)
+    queryset = RoomMessage.objects.filter(condition).order_by()
+    for rows in _batches(queryset, ('id', 'image', 'file'), batch_size, max_batches, pause):
+        start = time.perf_counter()
+        with transaction.atomic():
+            RoomMessage.objects.filter(id__in=[row[0] for row in rows]).delete()
+            files = _delete_files_later([name for row in rows for name in row[1:]])
+        stats.add_batch(len(rows), files, time.perf_counter() - start)
+    return stats
+
+
+def trim_changelog(cutoff, batch_size, max_batches=None, pause=0.0):
+    stats = PurgeStats('changelog entries')
+    # Oldest entries have the lowest ids, so walking the primary key finds them first
+    queryset = ChangeLogEntry.objects.filter(created_at__lt=cutoff).order_by('id')
+    for rows in _batches(queryset, ('id',), batch_size, max_batches, pause):
+        start = time.perf_counter()
+        ChangeLogEntry.objects.filter(id__in=[row[0] for row in rows]).delete()
+        stats.add_batch(len(rows), 0, time.perf_counter() - start)
+    return stats
+
+
+def purge(batch_size, max_batches=None, pause=0.0):
+    """Run every expiry and retention pass; returns a PurgeStats per pass"""
+    now = timezone.now()
+    options = {'batch_size': batch_size, 'max_batches': max_batches, 'pause': pause}
+    results = [
+        purge_messages(Q(expires_at__lte=now), 'expired messages', **options),
+        purge_room_messages(Q(expires_at__lte=now), 'expired group messages', **options),
+    ]
+
+    retention_days = getattr(settings, 'CHAT_MESSAGE_RETENTION_DAYS', None)
+    if retention_days:
+        cutoff = now - timedelta(days=retention_days)
+        results.append(purge_messages(Q(timestamp__lt=cutoff), 'messages past retention', **options))
+        results.append(purge_room_messages(Q(timestamp__lt=cutoff), 'group messages past retention', **options))
+
+    changelog_days = getattr(settings, 'CHAT_CHANGELOG_RETENTION_DAYS', None)
+    if changelog_days:
+        results.append(trim_changelog(now - timedelta(days=changelog_days), **options))
+    return results
@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import friend_graph
+from .caching import bump_relationship_version, bump_directory_version
+from .models import Friendship, BlockedUser
+
+
+@receiver([post_save, post_delete], sender=Friendship)
+def friendship_changed(sender, instance, **kwargs):
+    bump_relationship_version(instance.from_user_id, instance.to_user_id)
+    # After commit, so readers refilling the cache see the new rows
+    transaction.on_commit(lambda: friend_graph.invalidate(instance.from_user_id, instance.to_user_id))
+
+
+@receiver([post_save, post_delete], sender=BlockedUser)
+def block_changed(sender, instance, **kwargs):
+    bump_relationship_version(instance.blocker_id, instance.blocked_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which no cached list displays
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_directory_version()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    bump_directory_version()
@@ -0,0 +1,167 @@
+"""
+A small database-backed task queue.
+
+Tasks are rows in the Task table. Views enqueue work with `some_task.delay(...)`
+and the `run_tasks` management command claims due rows, runs them on a
+thread pool and retries failures with exponential backoff. A claimed task is
+invisible to other workers until its visibility timeout passes, after which
+it is handed out again (e.g. if its worker was killed).
+"""
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+
+logger = logging.getLogger('chat.tasks')
+
+_registry = {}
+
+
+def task(name=None, max_attempts=5, retry_delay=30):
+    """
+    Register a function as a task.
+
+    The function gains a `.delay(**kwargs)` method that enqueues it; kwargs
+    must be JSON serializable. Failed attempts are retried after
+    retry_delay * 2**(attempt - 1) seconds until max_attempts is reached.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+
+        @wraps(func)
+        def delay(**kwargs):
+            return enqueue(task_name, kwargs)
+
+        func.task_name = task_name
+        func.max_attempts = max_attempts
+        func.retry_delay = retry_delay
+        func.delay = delay
+        _registry[task_name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, run_after=None):
+    func = _registry[name]
+    payload = payload or {}
+
+    if getattr(settings, 'CHAT_TASKS_ALWAYS_EAGER', False):
+        # Development mode: run in-process once the surrounding transaction commits
+        transaction.on_commit(lambda: func(**payload))
+        return None
+
+    return Task.objects.create(
+        name=name,
+        payload=payload,
+        max_attempts=func.max_attempts,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def claim_tasks(limit, visibility_timeout):
+    """Atomically mark up to `limit` due tasks as running and return them"""
+    now = timezone.now()
+    due = Task.objects.filter(
+        Q(status='queued', run_after__lte=now) |
+        Q(status='running', locked_until__lt=now)
+    ).order_by('run_after')[:limit * 2]
+
+    claimed = []
+    for candidate in due:
+        if candidate.status == 'running' and candidate.attempts >= candidate.max_attempts:
+            # Its last worker died mid-run and no attempts are left
+            Task.objects.filter(pk=candidate.pk, status='running', attempts=candidate.attempts).update(
+                status='failed', locked_until=None, last_error='Visibility timeout expired on final attempt'
+            )
+            continue
+
+        # Compare-and-set on the fields we read, so two workers never claim the same row
+        updated = Task.objects.filter(
+            pk=candidate.pk,
+            status=candidate.status,
+            attempts=candidate.attempts,
+        ).update(
+            status='running',
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            candidate.status = 'running'
+            candidate.attempts += 1
+            claimed.append(candidate)
+            if len(claimed) >= limit:
+                break
+    return claimed
+
+
+def _claimed(task_row):
+    """
+    The task's row as long as this worker still holds the claim.
+
+    A task that outlives its visibility timeout is re-claimed by another
+    worker, which bumps attempts; the stale worker's outcome then matches
+    nothing instead of overwriting the new run's state.
+    """
+    return Task.objects.filter(pk=task_row.pk, status='running', attempts=task_row.attempts)
+
+
+def _log_expired_claim(task_row):
+    logger.warning(
+        'Task %s (%s) finished after its claim expired; outcome left to the newer run',
+        task_row.pk, task_row.name
+    )
+
+
+def run_task(task_row):
+    """Execute one claimed task and record the outcome"""
+    func = _registry.get(task_row.name)
+    try:
+        if func is None:
+            raise LookupError(f'Unknown task {task_row.name!r}')
+        func(**task_row.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if task_row.attempts >= task_row.max_attempts or func is None:
+            if _claimed(task_row).update(status='failed', locked_until=None, last_error=error):
+                logger.error('Task %s (%s) failed permanently:\n%s', task_row.pk, task_row.name, error)
+            else:
+                _log_expired_claim(task_row)
+        else:
+            backoff = func.retry_delay * 2 ** (task_row.attempts - 1)
+            if _claimed(task_row).update(
+                status='queued',
+                locked_until=None,
+                run_after=timezone.now() + timedelta(seconds=backoff),
+                last_error=error,
+            ):
+                logger.warning('Task %s (%s) failed, retrying in %ss', task_row.pk, task_row.name, backoff)
+            else:
+                _log_expired_claim(task_row)
+        return False
+    else:
+        if not _claimed(task_row).delete()[0]:
+            _log_expired_claim(task_row)
+        return True
+    finally:
+        close_old_connections()
+
+
+def run_pending(executor, limit, visibility_timeout):
+    """Claim a batch of due tasks, run them on `executor` and wait; returns the number run"""
+    tasks = claim_tasks(limit, visibility_timeout)
+    if tasks:
+        wait([executor.submit(run_task, task_row) for task_row in tasks])
+    return len(tasks)
+
+
+def make_executor(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-task')
@@ -0,0 +1,31 @@
+import os
+
+from django.core.files.storage import default_storage
+
+from . import changelog
+from .images import make_thumbnail
+from .models import Message
+from .taskqueue import task
+
+
+@task(name='chat.create_thumbnail', max_attempts=3)
+def create_thumbnail(message_id):
+    """Store a downscaled copy of an image attachment for the chat view"""
+    message = Message.objects.filter(id=message_id).only('id', 'sender_id', 'receiver_id', 'image', 'thumbnail').first()
+    if message is None or not message.image or message.thumbnail:
+        return
+
+    with message.image.open('rb') as image_file:
+        thumbnail = make_thumbnail(image_file)
+
+    base_name = os.path.splitext(os.path.basename(message.image.name))[0]
+    message.thumbnail.save(f'{base_name}.jpg', thumbnail, save=False)
+    Message.objects.filter(id=message_id).update(thumbnail=message.thumbnail.name)
+    changelog.record_for_conversation('message', [message_id], message.sender_id, message.receiver_id)
+
+
+@task(name='chat.delete_files', max_attempts=5)
+def delete_files(names):
+    """Remove attachment files left behind by purged messages"""
+    for name in names:
+        default_storage.delete(name)
@@ -0,0 +1,29 @@
+from time import perf_counter
+
+from django.template.backends.django import DjangoTemplates, Template
+
+from .metrics import current_request_stats
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current_request_stats()
+        if stats is None:
+            return super().render(context, request)
+
+        start = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates backend that reports render time to RequestMetricsMiddleware"""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -1,3 +1,299 @@
-from django.test import TestCase
+import re
+import subprocess
+import sys
+from datetime import timedelta
+from html import unescape
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import changelog, encoding, retention
+from .models import BlockedUser, ChangeLogEntry, Friendship, Message, Room, RoomMembership, RoomMessage, Task
+from .presence import heartbeat
+
+
+@override_settings(CHAT_SYNC_SETTLE_SECONDS=0, CHAT_RATE_LIMITS={'poll': (1000.0, 1000)})
+class ChangeLogTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def send(self, content='hi'):
+        message = Message.objects.create(sender=self.alice, receiver=self.bob, content=content)
+        changelog.record_for_conversation('message', [message.id], self.alice.id, self.bob.id)
+        return message
+
+    def record(self, kind, message):
+        changelog.record_for_conversation(kind, [message.id], self.alice.id, self.bob.id)
+
+    def sync(self, since=0, **params):
+        self.client.force_login(self.alice)
+        return self.client.get(reverse('sync_messages', args=[self.bob.id]), {'since': since, **params}).json()
+
+    def test_entries_for_one_message_collapse(self):
+        first, second = self.send(), self.send()
+        self.record('status', first)
+        self.record('status', first)
+
+        changed, deleted, cursor, more = changelog.changes_since(self.alice.id, self.bob.id, 0)
+        self.assertEqual(changed, {first.id, second.id})
+        self.assertEqual(deleted, set())
+        self.assertEqual(cursor, changelog.latest_cursor(self.alice.id, self.bob.id))
+        self.assertFalse(more)
+
+    def test_delete_wins_over_earlier_and_later_changes(self):
+        message = self.send()
+        self.record('delete', message)
+        self.record('status', message)
+
+        changed, deleted, _, _ = changelog.changes_since(self.alice.id, self.bob.id, 0)
+        self.assertEqual(changed, set())
+        self.assertEqual(deleted, {message.id})
+
+    def test_entries_are_per_user_and_peer(self):
+        carol = User.objects.create_user('carol')
+        other = Message.objects.create(sender=self.alice, receiver=carol, content='hi')
+        changelog.record_for_conversation('message', [other.id], self.alice.id, carol.id)
+        message = self.send()
+
+        changed, _, _, _ = changelog.changes_since(self.alice.id, self.bob.id, 0)
+        self.assertEqual(changed, {message.id})
+        changed, _, _, _ = changelog.changes_since(self.bob.id, self.alice.id, 0)
+        self.assertEqual(changed, {message.id})
+
+    @override_settings(CHAT_SYNC_BATCH_SIZE=2)
+    def test_full_batch_sets_more_and_stops_the_cursor(self):
+        messages = [self.send() for _ in range(3)]
+
+        changed, _, cursor, more = changelog.changes_since(self.alice.id, self.bob.id, 0)
+        self.assertEqual(changed, {messages[0].id, messages[1].id})
+        self.assertTrue(more)
+
+        changed, _, _, more = changelog.changes_since(self.alice.id, self.bob.id, cursor)
+        self.assertEqual(changed, {messages[2].id})
+        self.assertFalse(more)
+
+    @override_settings(CHAT_SYNC_SETTLE_SECONDS=60)
+    def test_cursor_stays_below_unsettled_entries(self):
+        message = self.send()
+        first_entry = ChangeLogEntry.objects.filter(user=self.alice).earliest('id')
+
+        changed, _, cursor, more = changelog.changes_since(self.alice.id, self.bob.id, 0)
+        # Returned straight away, but served again until settled
+        self.assertEqual(changed, {message.id})
+        self.assertEqual(cursor, first_entry.id - 1)
+        self.assertFalse(more)
+        self.assertEqual(changelog.latest_cursor(self.alice.id, self.bob.id), first_entry.id - 1)
+
+    def test_sync_resumes_from_cursor(self):
+        self.send('first')
+        snapshot = self.sync(0)
+        self.assertTrue(snapshot['reset'])
+        self.assertEqual([row['content'] for row in snapshot['messages']], ['first'])
+
+        self.send('second')
+        changes = self.sync(snapshot['cursor'])
+        self.assertFalse(changes['reset'])
+        self.assertEqual([row['content'] for row in changes['messages']], ['second'])
+
+    def test_trimmed_cursor_resets_to_snapshot(self):
+        self.send('first')
+        cursor = self.sync(0)['cursor']
+        self.send('second')
+        self.send('third')
+        # Trim everything up to and including the entries right after the cursor
+        ChangeLogEntry.objects.filter(id__lte=cursor + 2).delete()
+        self.assertGreater(changelog.oldest_cursor(), cursor + 1)
+
+        response = self.sync(cursor)
+        self.assertTrue(response['reset'])
+        self.assertEqual([row['content'] for row in response['messages']], ['first', 'second', 'third'])
+        self.assertEqual(response['cursor'], changelog.latest_cursor(self.alice.id, self.bob.id))
+
+    @override_settings(CHAT_SYNC_SNAPSHOT_MESSAGES=2)
+    def test_older_history_is_paged_before_the_snapshot(self):
+        for index in range(5):
+            self.send(str(index))
+
+        snapshot = self.sync(0)
+        self.assertEqual([row['content'] for row in snapshot['messages']], ['3', '4'])
+        older = self.sync(before=snapshot['messages'][0]['id'])
+        self.assertEqual([row['content'] for row in older['messages']], ['1', '2'])
+        self.assertTrue(older['more'])
+        oldest = self.sync(before=older['messages'][0]['id'])
+        self.assertEqual([row['content'] for row in oldest['messages']], ['0'])
+        self.assertFalse(oldest['more'])
+
+
+@override_settings(CHAT_SYNC_SETTLE_SECONDS=0, CHAT_RATE_LIMITS={'poll': (1000.0, 1000)})
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def send(self, content='hi', expires_at=None):
+        message = Message.objects.create(
+            sender=self.alice, receiver=self.bob, content=content, expires_at=expires_at
+        )
+        changelog.record_for_conversation('message', [message.id], self.alice.id, self.bob.id)
+        return message
+
+    def sync(self, since):
+        self.client.force_login(self.alice)
+        return self.client.get(reverse('sync_messages', args=[self.bob.id]), {'since': since}).json()
+
+    def test_purge_deletes_in_batches_and_logs_deletes(self):
+        past = timezone.now() - timedelta(minutes=1)
+        expired = [self.send(expires_at=past) for _ in range(3)]
+        kept = self.send(expires_at=timezone.now() + timedelta(hours=1))
+
+        stats = retention.purge_messages(Q(expires_at__lte=timezone.now()), 'expired', batch_size=2)
+
+        self.assertEqual((stats.rows, stats.batches), (3, 2))
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [kept.id])
+        for user, peer in ((self.alice, self.bob), (self.bob, self.alice)):
+            self.assertEqual(
+                set(ChangeLogEntry.objects.filter(user=user, peer=peer, kind='delete').values_list('message_id', flat=True)),
+                {message.id for message in expired}
+            )
+
+    def test_purge_respects_max_batches(self):
+        past = timezone.now() - timedelta(minutes=1)
+        for _ in range(3):
+            self.send(expires_at=past)
+
+        stats = retention.purge_messages(
+            Q(expires_at__lte=timezone.now()), 'expired', batch_size=1, max_batches=2
+        )
+        self.assertEqual(stats.rows, 2)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_sync_expire_sync(self):
+        message = self.send('soon gone', expires_at=timezone.now() + timedelta(hours=1))
+        snapshot = self.sync(0)
+        self.assertEqual([row['id'] for row in snapshot['messages']], [message.id])
+        self.assertIsNotNone(snapshot['messages'][0]['expires_at'])
+
+        Message.objects.filter(id=message.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        # Hidden from snapshots at once; clients drop their copy using expires_at
+        self.assertEqual(self.sync(0)['messages'], [])
+        changes = self.sync(snapshot['cursor'])
+        self.assertEqual((changes['messages'], changes['deleted']), ([], []))
+
+        retention.purge(batch_size=100)
+        changes = self.sync(snapshot['cursor'])
+        self.assertEqual(changes['deleted'], [message.id])
+        self.assertEqual(changes['messages'], [])
+
+
+@override_settings(CHAT_RATE_LIMITS={'poll': (1000.0, 1000)})
+class ConversationPresenceTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        heartbeat(self.alice.id, typing_in=f'u{self.bob.id}')
+        self.client.force_login(self.bob)
+
+    def poll(self, name):
+        return self.client.get(reverse(name, args=[self.alice.id])).json()
+
+    def test_friends_see_presence_and_typing(self):
+        Friendship.objects.create(from_user=self.alice, to_user=self.bob, status='accepted')
+        for name in ('get_messages', 'sync_messages'):
+            data = self.poll(name)
+            self.assertTrue(data['presence']['online'])
+            self.assertTrue(data['typing'])
+
+    def test_hidden_from_non_friends_and_blocked_users(self):
+        for name in ('get_messages', 'sync_messages'):
+            data = self.poll(name)
+            self.assertEqual((data['presence'], data['typing']), (None, False))
+
+        Friendship.objects.create(from_user=self.alice, to_user=self.bob, status='accepted')
+        BlockedUser.objects.create(blocker=self.alice, blocked=self.bob)
+        for name in ('get_messages', 'sync_messages'):
+            data = self.poll(name)
+            self.assertEqual((data['presence'], data['typing']), (None, False))
+
+
+class MessageAdminTests(TestCase):
+    def test_changelist_rows_are_not_preselected(self):
+        admin = User.objects.create_superuser('admin', password=None)
+        bob = User.objects.create_user('bob')
+        Message.objects.bulk_create([Message(sender=admin, receiver=bob, content='hi') for _ in range(3)])
+        self.client.force_login(admin)
+
+        html = self.client.get(reverse('admin:chat_message_changelist')).content.decode()
+        checkboxes = re.findall(r'<input[^>]*class="action-select"[^>]*>', html)
+        self.assertEqual(len(checkboxes), 3)
+        for checkbox in checkboxes:
+            self.assertNotIn('checked', checkbox)
+
+
+class RoomTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.client.force_login(self.alice)
+
+    def create_room(self, name='Team'):
+        room = Room.objects.create(name=name, created_by=self.alice)
+        RoomMembership.objects.create(room=room, user=self.alice, is_admin=True)
+        return room
+
+    def test_room_name_is_not_written_into_scripts(self):
+        room = self.create_room("x');alert(document.cookie);('")
+
+        html = self.client.get(reverse('room_chat', args=[room.id])).content.decode()
+        # Browsers unescape attribute values before running inline handlers
+        for handler in re.findall(r'onclick="([^"]*)"', html):
+            self.assertNotIn('alert', unescape(handler))
+
+    def test_expired_messages_are_not_counted_as_unread(self):
+        room = self.create_room()
+        bob = User.objects.create_user('bob')
+        RoomMembership.objects.create(room=room, user=bob)
+        RoomMessage.objects.create(room=room, sender=bob, content='live')
+        RoomMessage.objects.create(
+            room=room, sender=bob, content='gone', expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        memberships = self.client.get(reverse('rooms_list')).context['memberships']
+        self.assertEqual([membership.unread_count for membership in memberships], [1])
+
+    @override_settings(CHAT_PURGE_BATCH_SIZE=2)
+    def test_last_member_leaving_purges_messages_and_files(self):
+        room = self.create_room()
+        for index in range(3):
+            RoomMessage.objects.create(room=room, sender=self.alice, content='hi', file=f'chat_files/{index}.txt')
+
+        self.client.post(reverse('leave_room', args=[room.id]))
+
+        self.assertFalse(Room.objects.filter(id=room.id).exists())
+        self.assertFalse(RoomMessage.objects.exists())
+        queued = [name for task in Task.objects.filter(name='chat.delete_files') for name in task.payload['names']]
+        self.assertEqual(sorted(queued), [f'chat_files/{index}.txt' for index in range(3)])
+
+
+class EncodingTests(TestCase):
+    def test_optional_codecs_are_not_imported_at_startup(self):
+        script = (
+            'import sys, django; django.setup(); import chat.urls; '
+            'print(",".join(name for name in ("msgpack", "brotli") if name in sys.modules))'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_codecs_are_imported_when_used(self):
+        if not (encoding.is_installed('msgpack') and encoding.is_installed('brotli')):
+            self.skipTest('msgpack and brotli are optional')
+        import brotli
+        import msgpack
+
+        body = encoding.encode_payload(encoding.MSGPACK, 'rows', ('id',), [(1,), (2,)])
+        self.assertEqual(msgpack.unpackb(brotli.decompress(encoding.compress(body, 'br')))['rows']['rows'], [[1], [2]])
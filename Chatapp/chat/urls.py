@@ -8,6 +8,7 @@ urlpatterns = [
     path('logout/', views.user_logout, name='logout'),
     path('chat/<int:user_id>/', views.chat_room, name='chat_room'),
     path('api/messages/<int:user_id>/', views.get_messages, name='get_messages'),
+    path('api/messages/<int:user_id>/sync/', views.sync_messages, name='sync_messages'),
     path('api/message/<int:message_id>/status/', views.update_message_status, name='update_message_status'),
     path('api/notifications/', views.check_new_messages, name='check_new_messages'),
     
@@ -23,4 +24,24 @@ urlpatterns = [
     path('unblock/<int:user_id>/', views.unblock_user, name='unblock_user'),
     path('blocked-users/', views.blocked_users, name='blocked_users'),
     path('search-users/', views.search_users, name='search_users'),
+    path('api/friends/<int:user_id>/mutual/', views.mutual_friends, name='mutual_friends'),
+    path('api/friends/suggestions/', views.friend_suggestions, name='friend_suggestions'),
+    path('api/friends/requests/accept-all/', views.accept_all_friend_requests, name='accept_all_friend_requests'),
+    path('api/friends/requests/reject/', views.reject_friend_requests, name='reject_friend_requests'),
+    path('api/friends/block/', views.block_users, name='block_users'),
+    path('api/friends/invite/', views.invite_friends, name='invite_friends'),
+
+    # Group Conversation URLs
+    path('rooms/', views.rooms_list, name='rooms_list'),
+    path('rooms/create/', views.create_room, name='create_room'),
+    path('rooms/<int:room_id>/', views.room_chat, name='room_chat'),
+    path('rooms/<int:room_id>/add-members/', views.add_room_members, name='add_room_members'),
+    path('rooms/<int:room_id>/leave/', views.leave_room, name='leave_room'),
+    path('api/rooms/<int:room_id>/messages/', views.get_room_messages, name='get_room_messages'),
+
+    # Presence
+    path('api/presence/heartbeat/', views.presence_heartbeat, name='presence_heartbeat'),
+
+    # Monitoring
+    path('metrics', views.metrics_endpoint, name='metrics'),
 ]
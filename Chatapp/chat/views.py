@@ -1,13 +1,40 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
-from django.db.models import Q
-from .models import Message, Friendship, BlockedUser
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Q, Case, Count, F, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce
+from .models import Message, Friendship, BlockedUser, Room, RoomMembership, RoomMessage
+from django.http import JsonResponse, HttpResponse, Http404
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
 from django.contrib import messages
+from django.conf import settings
+from .encoding import table_response
+from . import changelog, friend_graph, metrics, retention
+from .caching import bump_relationship_version, list_version, list_cache_timeout, message_cache_timeout
+from .middleware import skip_session_save
+from .ratelimit import rate_limit, suggested_poll_interval
+from .tasks import create_thumbnail
+from .presence import (
+    CONVERSATION_KEY_RE, heartbeat, heartbeat_interval_ms, stop_typing, presence_for, typing_users
+)
+
+
+# Column layouts of the polling APIs (see chat/encoding.py for the wire formats)
+MESSAGE_COLUMNS = (
+    'id', 'sender', 'content', 'timestamp', 'is_sender', 'status', 'image', 'thumbnail', 'file', 'file_name',
+    'expires_at'
+)
+NOTIFICATION_COLUMNS = ('id', 'sender', 'sender_id', 'content', 'timestamp', 'has_image', 'has_file')
+ROOM_MESSAGE_COLUMNS = (
+    'id', 'sender', 'content', 'timestamp', 'is_sender', 'image', 'file', 'file_name', 'expires_at'
+)
 
 
 def register(request):
@@ -44,32 +71,38 @@ def user_logout(request):
 
 @login_required
 def user_list(request):
+    # Built lazily so a cached fragment skips the queries entirely
+    users_data = SimpleLazyObject(lambda: _user_list_data(request.user))
+    return render(request, 'chat/user_list.html', {
+        'users_data': users_data,
+        # Kept out of the cached fragment; applied to the list client-side
+        'presence': presence_for(friend_graph.friend_ids(request.user.id)),
+        'presence_heartbeat_ms': heartbeat_interval_ms(),
+        'list_version': list_version(request),
+        'list_cache_timeout': list_cache_timeout(),
+    })
+
+
+def _user_list_data(current_user):
     # Get all users except current user
-    all_users = User.objects.exclude(id=request.user.id)
+    all_users = User.objects.exclude(id=current_user.id)
     
     # Get blocked users
-    blocked_user_ids = BlockedUser.objects.filter(blocker=request.user).values_list('blocked_id', flat=True)
-    blocked_by_ids = BlockedUser.objects.filter(blocked=request.user).values_list('blocker_id', flat=True)
+    blocked_user_ids = set(BlockedUser.objects.filter(blocker=current_user).values_list('blocked_id', flat=True))
+    blocked_by_ids = set(BlockedUser.objects.filter(blocked=current_user).values_list('blocker_id', flat=True))
     
     # Get friends (accepted friendships)
-    friend_ids = Friendship.objects.filter(
-        Q(from_user=request.user, status='accepted') |
-        Q(to_user=request.user, status='accepted')
-    ).values_list('from_user_id', 'to_user_id')
-    
-    friend_id_list = set()
-    for from_id, to_id in friend_ids:
-        friend_id_list.add(from_id if from_id != request.user.id else to_id)
+    friend_id_list = friend_graph.friend_ids(current_user.id)
     
     # Get pending requests sent by current user
-    sent_request_ids = Friendship.objects.filter(
-        from_user=request.user, status='pending'
-    ).values_list('to_user_id', flat=True)
+    sent_request_ids = set(Friendship.objects.filter(
+        from_user=current_user, status='pending'
+    ).values_list('to_user_id', flat=True))
     
     # Get pending requests received by current user
-    received_request_ids = Friendship.objects.filter(
-        to_user=request.user, status='pending'
-    ).values_list('from_user_id', flat=True)
+    received_request_ids = set(Friendship.objects.filter(
+        to_user=current_user, status='pending'
+    ).values_list('from_user_id', flat=True))
     
     # Categorize users
     users_data = []
@@ -90,18 +123,16 @@ def user_list(request):
             'status': status
         })
     
-    return render(request, 'chat/user_list.html', {'users_data': users_data})
+    return users_data
 
 
 @login_required
+@rate_limit('send', methods=('POST',), json=False)
 def chat_room(request, user_id):
     other_user = get_object_or_404(User, id=user_id)
     
     # Check if users are friends
-    are_friends = Friendship.objects.filter(
-        Q(from_user=request.user, to_user=other_user, status='accepted') |
-        Q(from_user=other_user, to_user=request.user, status='accepted')
-    ).exists()
+    are_friends = friend_graph.are_friends(request.user.id, other_user.id)
     
     # Check if blocked
     is_blocked = BlockedUser.objects.filter(
@@ -113,25 +144,11 @@ def chat_room(request, user_id):
         messages.error(request, 'You can only chat with your friends.')
         return redirect('user_list')
     
-    message_list = Message.objects.filter(
-        Q(sender=request.user, receiver=other_user) |
-        Q(sender=other_user, receiver=request.user)
-    ).order_by('timestamp')
-    
-    # Mark received messages as delivered and read
-    unread_messages = Message.objects.filter(sender=other_user, receiver=request.user, status='sent')
-    unread_messages.update(status='delivered', delivered_at=timezone.now())
-    
-    Message.objects.filter(
-        sender=other_user, 
-        receiver=request.user, 
-        is_read=False
-    ).update(is_read=True, status='read', read_at=timezone.now())
-    
     if request.method == 'POST':
         content = request.POST.get('content')
         image = request.FILES.get('image')
         file = request.FILES.get('file')
+        ttl = retention.ttl_from_post(request.POST.get('ttl'))
         
         if content or image or file:
             msg = Message.objects.create(
@@ -141,46 +158,157 @@ def chat_room(request, user_id):
                 image=image,
                 file=file,
                 file_name=file.name if file else None,
-                status='sent'
+                status='sent',
+                expires_at=timezone.now() + ttl if ttl else None
             )
+            changelog.record_for_conversation('message', [msg.id], request.user.id, other_user.id)
+            # Side-effects run in the task worker, off the request path
+            if image:
+                create_thumbnail.delay(message_id=msg.id)
+            # Receipts are updated by the GET this redirects to
             return redirect('chat_room', user_id=user_id)
     
+    _mark_conversation_read(request.user, other_user)
+    
+    # Older history comes from the client's IndexedDB cache and sync_messages
+    message_list = list(_conversation(request.user, other_user).order_by('-id')[:changelog.snapshot_size()])[::-1]
+    
     return render(request, 'chat/chat_room.html', {
         'other_user': other_user,
-        'messages': message_list
+        'other_presence': presence_for([other_user.id])[other_user.id],
+        'presence_heartbeat_ms': heartbeat_interval_ms(),
+        'typing_conversation': f'u{other_user.id}',
+        'messages': message_list,
+        # A full snapshot may have older history behind it, fetched with sync_messages?before=
+        'has_older_messages': len(message_list) >= changelog.snapshot_size(),
+        'message_cache_timeout': message_cache_timeout(),
+        'ttl_choices': retention.ttl_choices(),
     })
 
 
+def _conversation(user, other_user):
+    return Message.objects.filter(
+        Q(sender=user, receiver=other_user) |
+        Q(sender=other_user, receiver=user)
+    ).filter(retention.live())
+
+
+def _mark_conversation_read(user, other_user):
+    """Mark everything other_user sent to user as delivered and read, logging the status changes"""
+    unread_ids = list(Message.objects.filter(
+        sender=other_user, receiver=user, is_read=False
+    ).values_list('id', flat=True))
+    if not unread_ids:
+        return
+    
+    now = timezone.now()
+    with transaction.atomic():
+        Message.objects.filter(id__in=unread_ids, status='sent').update(status='delivered', delivered_at=now)
+        Message.objects.filter(id__in=unread_ids).update(is_read=True, status='read', read_at=now)
+        # Only the sender shows receipts, so only their log needs the change
+        changelog.record('status', unread_ids, (other_user.id, user.id))
+
+
+def _message_row(msg, user):
+    return (
+        msg.id,
+        msg.sender.username,
+        msg.content,
+        msg.timestamp,
+        msg.sender_id == user.id,
+        msg.status,
+        msg.image.url if msg.image else None,
+        msg.thumbnail.url if msg.thumbnail else None,
+        msg.file.url if msg.file else None,
+        msg.file_name,
+        msg.expires_at
+    )
+
+
+def _conversation_presence(user, other_user):
+    """(presence, typing) of other_user; only shared between friends where neither has blocked the other"""
+    if not friend_graph.are_friends(user.id, other_user.id) or BlockedUser.objects.filter(
+        Q(blocker=user, blocked=other_user) | Q(blocker=other_user, blocked=user)
+    ).exists():
+        return None, False
+    return presence_for([other_user.id])[other_user.id], bool(typing_users(f'u{user.id}', [other_user.id]))
+
+
+@skip_session_save
 @login_required
+@rate_limit('poll')
 def get_messages(request, user_id):
     """API endpoint to fetch new messages"""
     other_user = get_object_or_404(User, id=user_id)
-    messages = Message.objects.filter(
-        Q(sender=request.user, receiver=other_user) |
-        Q(sender=other_user, receiver=request.user)
-    ).order_by('timestamp')
-    
-    # Mark received messages as delivered
-    undelivered = Message.objects.filter(sender=other_user, receiver=request.user, status='sent')
-    undelivered.update(status='delivered', delivered_at=timezone.now())
-    
-    # Mark received messages as read
-    unread = Message.objects.filter(sender=other_user, receiver=request.user, is_read=False)
-    unread.update(is_read=True, status='read', read_at=timezone.now())
-    
-    messages_data = [{
-        'id': msg.id,
-        'sender': msg.sender.username,
-        'content': msg.content,
-        'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-        'is_sender': msg.sender == request.user,
-        'status': msg.status,
-        'image': msg.image.url if msg.image else None,
-        'file': msg.file.url if msg.file else None,
-        'file_name': msg.file_name
-    } for msg in messages]
-    
-    return JsonResponse({'messages': messages_data})
+    _mark_conversation_read(request.user, other_user)
+    
+    messages = _conversation(request.user, other_user).select_related('sender').order_by('timestamp')
+    rows = [_message_row(msg, request.user) for msg in messages]
+    
+    presence, typing = _conversation_presence(request.user, other_user)
+    return table_response(request, 'messages', MESSAGE_COLUMNS, rows, extra={
+        'presence': presence,
+        'typing': typing,
+        'poll_interval': suggested_poll_interval(request)
+    }, dictionary_columns=('sender', 'status'))
+
+
+def _older_messages(request, other_user, before):
+    """Up to a snapshot's worth of messages preceding message id `before`; history the snapshot left out"""
+    conversation = _conversation(request.user, other_user).select_related('sender')
+    messages = list(conversation.filter(id__lt=before).order_by('-id')[:changelog.snapshot_size() + 1])
+    more = len(messages) > changelog.snapshot_size()
+    
+    rows = [_message_row(msg, request.user) for msg in messages[:changelog.snapshot_size()][::-1]]
+    return table_response(request, 'messages', MESSAGE_COLUMNS, rows, extra={
+        'more': more,
+        'poll_interval': suggested_poll_interval(request)
+    }, dictionary_columns=('sender', 'status'))
+
+
+@skip_session_save
+@login_required
+@rate_limit('poll')
+def sync_messages(request, user_id):
+    """API endpoint returning the conversation changes after the client's `since` cursor, or history `before` a message id"""
+    other_user = get_object_or_404(User, id=user_id)
+    try:
+        since = max(int(request.GET.get('since', 0)), 0)
+        before = max(int(request.GET.get('before', 0)), 0)
+    except ValueError:
+        since = before = 0
+    
+    if before:
+        return _older_messages(request, other_user, before)
+    
+    _mark_conversation_read(request.user, other_user)
+    conversation = _conversation(request.user, other_user).select_related('sender')
+    
+    # Entries after the client's cursor may have been trimmed; start it over
+    if since and since + 1 < changelog.oldest_cursor():
+        since = 0
+    
+    if since == 0:
+        # First sync on this device: the latest messages and the cursor they are current as of
+        cursor = changelog.latest_cursor(request.user.id, other_user.id)
+        messages = list(conversation.order_by('-id')[:changelog.snapshot_size()])[::-1]
+        deleted, more = set(), False
+    else:
+        changed, deleted, cursor, more = changelog.changes_since(request.user.id, other_user.id, since)
+        messages = list(conversation.filter(id__in=changed).order_by('id'))
+        deleted |= changed - {msg.id for msg in messages}
+    
+    rows = [_message_row(msg, request.user) for msg in messages]
+    presence, typing = _conversation_presence(request.user, other_user)
+    return table_response(request, 'messages', MESSAGE_COLUMNS, rows, extra={
+        'cursor': cursor,
+        'reset': since == 0,
+        'more': more,
+        'deleted': sorted(deleted),
+        'presence': presence,
+        'typing': typing,
+        'poll_interval': suggested_poll_interval(request)
+    }, dictionary_columns=('sender', 'status'))
 
 
 @login_required
@@ -197,31 +325,35 @@ def update_message_status(request, message_id):
         message.is_read = True
     
     message.save()
+    changelog.record('status', [message.id], (message.sender_id, message.receiver_id))
     return JsonResponse({'status': message.status})
 
 
+@skip_session_save
 @login_required
+@rate_limit('notifications')
 def check_new_messages(request):
     """Check for new messages for notifications"""
     unread_messages = Message.objects.filter(
+        retention.live(),
         receiver=request.user,
         is_read=False
     ).select_related('sender').order_by('-timestamp')
     
-    notifications = [{
-        'id': msg.id,
-        'sender': msg.sender.username,
-        'sender_id': msg.sender.id,
-        'content': msg.content[:50] if msg.content else 'Sent a file',
-        'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-        'has_image': bool(msg.image),
-        'has_file': bool(msg.file)
-    } for msg in unread_messages[:5]]  # Last 5 unread
+    rows = [(
+        msg.id,
+        msg.sender.username,
+        msg.sender_id,
+        msg.content[:50] if msg.content else 'Sent a file',
+        msg.timestamp,
+        bool(msg.image),
+        bool(msg.file)
+    ) for msg in unread_messages[:5]]  # Last 5 unread
     
-    return JsonResponse({
-        'notifications': notifications,
-        'count': unread_messages.count()
-    })
+    return table_response(request, 'notifications', NOTIFICATION_COLUMNS, rows, extra={
+        'count': unread_messages.count(),
+        'poll_interval': suggested_poll_interval(request, base=5000)
+    }, dictionary_columns=('sender',))
 
 
 # Friend Management Views
@@ -344,22 +476,34 @@ def unfriend_user(request, user_id):
 @login_required
 def friends_list(request):
     """View all friends"""
+    friends = SimpleLazyObject(lambda: _friends_data(request.user))
+    return render(request, 'chat/friends_list.html', {
+        'friends': friends,
+        # Kept out of the cached fragment; applied to the list client-side
+        'presence': presence_for(friend_graph.friend_ids(request.user.id)),
+        'presence_heartbeat_ms': heartbeat_interval_ms(),
+        'list_version': list_version(request),
+        'list_cache_timeout': list_cache_timeout(),
+    })
+
+
+def _friends_data(current_user):
     # Get accepted friendships
     friendships = Friendship.objects.filter(
-        Q(from_user=request.user, status='accepted') |
-        Q(to_user=request.user, status='accepted')
-    )
+        Q(from_user=current_user, status='accepted') |
+        Q(to_user=current_user, status='accepted')
+    ).select_related('from_user', 'to_user')
     
     friends = []
     for friendship in friendships:
-        friend = friendship.to_user if friendship.from_user == request.user else friendship.from_user
+        friend = friendship.to_user if friendship.from_user_id == current_user.id else friendship.from_user
         friends.append({
             'user': friend,
             'friendship_id': friendship.id,
             'since': friendship.updated_at
         })
     
-    return render(request, 'chat/friends_list.html', {'friends': friends})
+    return friends
 
 
 @login_required
@@ -464,3 +608,502 @@ def search_users(request):
         })
     
     return render(request, 'chat/search_users.html', {'users': users_data, 'query': query})
+
+
+# Friend Graph APIs
+
+@login_required
+def mutual_friends(request, user_id):
+    """API endpoint listing friends shared with another user"""
+    other_user = get_object_or_404(User, id=user_id)
+    
+    if BlockedUser.objects.filter(
+        Q(blocker=request.user, blocked=other_user) |
+        Q(blocker=other_user, blocked=request.user)
+    ).exists():
+        return JsonResponse({'mutual_friends': [], 'count': 0})
+    
+    mutual_ids = friend_graph.mutual_friend_ids(request.user.id, other_user.id)
+    mutual = User.objects.filter(id__in=mutual_ids).order_by('username').values('id', 'username')
+    return JsonResponse({'mutual_friends': list(mutual), 'count': len(mutual_ids)})
+
+
+@login_required
+def friend_suggestions(request):
+    """API endpoint for "people you may know", ranked by mutual friends"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    
+    # Never suggest blocked users or people with a request already pending either way
+    excluded = set()
+    for blocker_id, blocked_id in BlockedUser.objects.filter(
+        Q(blocker=request.user) | Q(blocked=request.user)
+    ).values_list('blocker_id', 'blocked_id'):
+        excluded.update((blocker_id, blocked_id))
+    for from_id, to_id in Friendship.objects.filter(
+        Q(from_user=request.user) | Q(to_user=request.user), status='pending'
+    ).values_list('from_user_id', 'to_user_id'):
+        excluded.update((from_id, to_id))
+    
+    ranked = friend_graph.suggestions(request.user.id, excluded=excluded, limit=limit)
+    usernames = dict(User.objects.filter(id__in=[user_id for user_id, _ in ranked]).values_list('id', 'username'))
+    
+    return JsonResponse({'suggestions': [
+        {'id': user_id, 'username': usernames[user_id], 'mutual_count': mutual_count}
+        for user_id, mutual_count in ranked if user_id in usernames
+    ]})
+
+
+# Bulk Friend APIs
+
+def _bulk_items(request, key):
+    """List under `key` in a JSON request body, or None when missing, malformed or too long"""
+    try:
+        items = json.loads(request.body or b'{}').get(key)
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(items, list) or len(items) > getattr(settings, 'CHAT_BULK_MAX_ITEMS', 500):
+        return None
+    return items
+
+
+def _bulk_ids(request, key):
+    items = _bulk_items(request, key)
+    if items is None or not all(type(item) is int for item in items):
+        return None
+    return set(items)
+
+
+def _bulk_error(key):
+    return JsonResponse({
+        'error': f'Expected a JSON body with a "{key}" list of at most '
+                 f'{getattr(settings, "CHAT_BULK_MAX_ITEMS", 500)} items'
+    }, status=400)
+
+
+def _relationships_changed(*user_ids):
+    # Bulk writes skip the Friendship/BlockedUser signals, so invalidate here
+    bump_relationship_version(*user_ids)
+    friend_graph.invalidate(*user_ids)
+
+
+@login_required
+@rate_limit('friends', methods=('POST',))
+def accept_all_friend_requests(request):
+    """API endpoint accepting every pending friend request in one UPDATE"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    with transaction.atomic():
+        pending = dict(Friendship.objects.select_for_update().filter(
+            to_user=request.user, status='pending'
+        ).values_list('id', 'from_user_id'))
+        Friendship.objects.filter(id__in=pending).update(status='accepted', updated_at=timezone.now())
+    
+    if pending:
+        _relationships_changed(request.user.id, *pending.values())
+    return JsonResponse({'accepted': sorted(pending.values())})
+
+
+@login_required
+@rate_limit('friends', methods=('POST',))
+def reject_friend_requests(request):
+    """API endpoint rejecting the pending friend requests listed in `request_ids`"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    request_ids = _bulk_ids(request, 'request_ids')
+    if request_ids is None:
+        return _bulk_error('request_ids')
+    
+    with transaction.atomic():
+        pending = dict(Friendship.objects.select_for_update().filter(
+            id__in=request_ids, to_user=request.user, status='pending'
+        ).values_list('id', 'from_user_id'))
+        Friendship.objects.filter(id__in=pending).update(status='rejected', updated_at=timezone.now())
+    
+    if pending:
+        _relationships_changed(request.user.id, *pending.values())
+    return JsonResponse({
+        'rejected': sorted(pending),
+        'not_found': sorted(request_ids - pending.keys())
+    })
+
+
+@login_required
+@rate_limit('friends', methods=('POST',))
+def block_users(request):
+    """API endpoint blocking every user in `user_ids` and removing any friendships with them"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    user_ids = _bulk_ids(request, 'user_ids')
+    if user_ids is None:
+        return _bulk_error('user_ids')
+    
+    targets = set(User.objects.filter(id__in=user_ids).exclude(id=request.user.id).values_list('id', flat=True))
+    
+    with transaction.atomic():
+        already_blocked = set(BlockedUser.objects.filter(
+            blocker=request.user, blocked_id__in=targets
+        ).values_list('blocked_id', flat=True))
+        Friendship.objects.filter(
+            Q(from_user=request.user, to_user_id__in=targets) |
+            Q(from_user_id__in=targets, to_user=request.user)
+        ).delete()
+        BlockedUser.objects.bulk_create([
+            BlockedUser(blocker=request.user, blocked_id=user_id) for user_id in targets - already_blocked
+        ], ignore_conflicts=True)
+    
+    if targets:
+        _relationships_changed(request.user.id, *targets)
+    return JsonResponse({
+        'blocked': sorted(targets - already_blocked),
+        'already_blocked': sorted(already_blocked),
+        'not_found': sorted(user_ids - targets)
+    })
+
+
+@login_required
+@rate_limit('friends', methods=('POST',))
+def invite_friends(request):
+    """API endpoint sending friend requests to a list of usernames or emails"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    identifiers = _bulk_items(request, 'identifiers')
+    if identifiers is None or not all(isinstance(item, str) for item in identifiers):
+        return _bulk_error('identifiers')
+    identifiers = {identifier.strip() for identifier in identifiers} - {''}
+    emails = {identifier for identifier in identifiers if '@' in identifier}
+    usernames = identifiers - emails
+    
+    # Resolve every identifier in one query; a shared email goes to its oldest account
+    resolved = {}
+    for user in User.objects.filter(Q(username__in=usernames) | Q(email__in=emails)).order_by('id'):
+        if user.username in usernames:
+            resolved[user.username] = user
+        if user.email in emails:
+            resolved.setdefault(user.email, user)
+    target_ids = {user.id for user in resolved.values()} - {request.user.id}
+    
+    results = {key: [] for key in (
+        'sent', 'already_friends', 'already_sent', 'received', 'blocked', 'not_found', 'invalid', 'duplicate'
+    )}
+    
+    with transaction.atomic():
+        blocked_ids = set()
+        for blocker_id, blocked_id in BlockedUser.objects.filter(
+            Q(blocker=request.user, blocked_id__in=target_ids) |
+            Q(blocker_id__in=target_ids, blocked=request.user)
+        ).values_list('blocker_id', 'blocked_id'):
+            blocked_ids.update((blocker_id, blocked_id))
+        
+        existing = {}
+        for friendship in Friendship.objects.select_for_update().filter(
+            Q(from_user=request.user, to_user_id__in=target_ids) |
+            Q(from_user_id__in=target_ids, to_user=request.user)
+        ).only('id', 'from_user_id', 'to_user_id', 'status'):
+            other_id = friendship.to_user_id if friendship.from_user_id == request.user.id else friendship.from_user_id
+            existing[other_id] = friendship
+        
+        new_ids, reopened, reported_ids = set(), set(), set()
+        for identifier in sorted(identifiers):
+            user = resolved.get(identifier)
+            friendship = existing.get(user.id) if user else None
+            if user is None:
+                results['not_found'].append(identifier)
+            elif user.id in reported_ids:
+                # A username and an email naming the same user are reported once
+                results['duplicate'].append(identifier)
+            elif user.id == request.user.id:
+                results['invalid'].append(identifier)
+            elif user.id in blocked_ids:
+                results['blocked'].append(identifier)
+            elif friendship is None:
+                new_ids.add(user.id)
+                results['sent'].append(identifier)
+            elif friendship.status == 'rejected':
+                reopened.add(friendship.id)
+                results['sent'].append(identifier)
+            elif friendship.status == 'accepted':
+                results['already_friends'].append(identifier)
+            elif friendship.from_user_id == request.user.id:
+                results['already_sent'].append(identifier)
+            else:
+                results['received'].append(identifier)
+            if user is not None:
+                reported_ids.add(user.id)
+        
+        Friendship.objects.bulk_create([
+            Friendship(from_user=request.user, to_user_id=user_id) for user_id in new_ids
+        ], ignore_conflicts=True)
+        # Rejected requests are re-sent from this user; to_user is assigned first because
+        # MySQL evaluates SET clauses left to right against already-updated columns
+        Friendship.objects.filter(id__in=reopened).update(
+            to_user=Case(When(to_user=request.user, then=F('from_user')), default=F('to_user')),
+            from_user=request.user,
+            status='pending',
+            updated_at=timezone.now()
+        )
+    
+    changed_ids = new_ids | {existing_id for existing_id, friendship in existing.items() if friendship.id in reopened}
+    if changed_ids:
+        _relationships_changed(request.user.id, *changed_ids)
+    return JsonResponse(results)
+
+
+# Group Conversations
+
+def _unread_room_messages(user):
+    """Subquery counting messages past a membership's read cursor, sent by someone else"""
+    return Subquery(
+        RoomMessage.objects.filter(
+            retention.live(),
+            room=OuterRef('room'),
+            id__gt=OuterRef('last_read_message_id')
+        ).exclude(sender=user).order_by().values('room').annotate(count=Count('id')).values('count')
+    )
+
+
+def _advance_read_cursor(membership_id, message_id):
+    # Cursors only move forward, so a stale page can't un-read newer messages
+    RoomMembership.objects.filter(
+        id=membership_id, last_read_message_id__lt=message_id
+    ).update(last_read_message_id=message_id)
+
+
+@login_required
+def rooms_list(request):
+    """View group conversations with unread counts"""
+    memberships = RoomMembership.objects.filter(user=request.user).select_related('room').annotate(
+        unread_count=Coalesce(_unread_room_messages(request.user), 0)
+    ).order_by('-room__last_message_id')
+    
+    friends = User.objects.filter(id__in=friend_graph.friend_ids(request.user.id)).order_by('username')
+    
+    return render(request, 'chat/rooms_list.html', {
+        'memberships': memberships,
+        'friends': friends,
+        'ttl_choices': retention.ttl_choices(),
+    })
+
+
+@login_required
+def create_room(request):
+    """Create a group conversation with some of your friends"""
+    if request.method != 'POST':
+        return redirect('rooms_list')
+    
+    name = request.POST.get('name', '').strip()
+    if not name:
+        messages.error(request, 'Please give the group a name.')
+        return redirect('rooms_list')
+    
+    member_ids = _friend_ids_from_post(request)
+    if not member_ids:
+        messages.error(request, 'Pick at least one friend to add to the group.')
+        return redirect('rooms_list')
+    
+    with transaction.atomic():
+        room = Room.objects.create(
+            name=name, created_by=request.user, message_ttl=retention.ttl_from_post(request.POST.get('ttl'))
+        )
+        RoomMembership.objects.bulk_create(
+            [RoomMembership(room=room, user=request.user, is_admin=True)] +
+            [RoomMembership(room=room, user_id=user_id) for user_id in member_ids]
+        )
+    
+    messages.success(request, f'Group "{room.name}" created.')
+    return redirect('room_chat', room_id=room.id)
+
+
+def _friend_ids_from_post(request):
+    """Selected member ids restricted to friends of the current user"""
+    try:
+        requested = {int(user_id) for user_id in request.POST.getlist('members')}
+    except ValueError:
+        return set()
+    
+    # Blocking removes the friendship, so friends are never blocked
+    return friend_graph.friends_among(request.user.id, requested)
+
+
+@login_required
+def add_room_members(request, room_id):
+    """Add friends to a group conversation (group admins only)"""
+    membership = get_object_or_404(RoomMembership, room_id=room_id, user=request.user, is_admin=True)
+    
+    if request.method == 'POST':
+        room = membership.room
+        member_ids = _friend_ids_from_post(request)
+        # New members start with everything already sent marked as read
+        RoomMembership.objects.bulk_create(
+            [RoomMembership(room=room, user_id=user_id, last_read_message_id=room.last_message_id)
+             for user_id in member_ids],
+            ignore_conflicts=True
+        )
+        if member_ids:
+            messages.success(request, f'Added {len(member_ids)} member(s) to {room.name}.')
+    
+    return redirect('room_chat', room_id=room_id)
+
+
+@login_required
+def leave_room(request, room_id):
+    """Leave a group conversation"""
+    membership = get_object_or_404(RoomMembership, room_id=room_id, user=request.user)
+    
+    if request.method == 'POST':
+        room = membership.room
+        membership.delete()
+        if not room.memberships.exists():
+            # Batched deletes that also queue attachment removal, instead of the ORM cascade
+            retention.purge_room_messages(
+                Q(room=room), 'messages of an empty room',
+                batch_size=getattr(settings, 'CHAT_PURGE_BATCH_SIZE', 1000)
+            )
+            room.delete()
+        messages.info(request, f'You left {room.name}.')
+    
+    return redirect('rooms_list')
+
+
+@login_required
+@rate_limit('send', methods=('POST',), json=False)
+def room_chat(request, room_id):
+    membership = get_object_or_404(
+        RoomMembership.objects.select_related('room'), room_id=room_id, user=request.user
+    )
+    room = membership.room
+    
+    if request.method == 'POST':
+        content = request.POST.get('content')
+        image = request.FILES.get('image')
+        file = request.FILES.get('file')
+        
+        if content or image or file:
+            # One row per message regardless of how many members the room has
+            msg = RoomMessage.objects.create(
+                room=room,
+                sender=request.user,
+                content=content if content else '',
+                image=image,
+                file=file,
+                file_name=file.name if file else None,
+                expires_at=timezone.now() + room.message_ttl if room.message_ttl else None
+            )
+            Room.objects.filter(id=room.id, last_message_id__lt=msg.id).update(last_message_id=msg.id)
+            _advance_read_cursor(membership.id, msg.id)
+        return redirect('room_chat', room_id=room_id)
+    
+    limit = getattr(settings, 'CHAT_ROOM_PAGE_SIZE', 100)
+    message_list = list(room.messages.filter(retention.live()).select_related('sender').order_by('-id')[:limit])[::-1]
+    if message_list:
+        _advance_read_cursor(membership.id, message_list[-1].id)
+    
+    friend_ids = friend_graph.friend_ids(request.user.id)
+    members = list(room.members.order_by('username'))
+    member_ids = {member.id for member in members}
+    
+    return render(request, 'chat/room_chat.html', {
+        'room': room,
+        'membership': membership,
+        'members': members,
+        'room_messages': message_list,
+        'presence_heartbeat_ms': heartbeat_interval_ms(),
+        'typing_conversation': f'r{room.id}',
+        'addable_friends': User.objects.filter(id__in=friend_ids - member_ids).order_by('username'),
+    })
+
+
+@skip_session_save
+@login_required
+@rate_limit('poll')
+def get_room_messages(request, room_id):
+    """API endpoint to fetch group messages newer than ?after=<message id>"""
+    membership = get_object_or_404(RoomMembership, room_id=room_id, user=request.user)
+    
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    
+    limit = getattr(settings, 'CHAT_ROOM_PAGE_SIZE', 100)
+    room_messages = list(RoomMessage.objects.filter(
+        retention.live(), room_id=room_id, id__gt=after
+    ).select_related('sender').order_by('id')[:limit])
+    
+    if room_messages:
+        _advance_read_cursor(membership.id, room_messages[-1].id)
+    
+    rows = [(
+        msg.id,
+        msg.sender.username,
+        msg.content,
+        msg.timestamp,
+        msg.sender_id == request.user.id,
+        msg.image.url if msg.image else None,
+        msg.file.url if msg.file else None,
+        msg.file_name,
+        msg.expires_at
+    ) for msg in room_messages]
+    
+    other_members = list(RoomMembership.objects.filter(
+        room_id=room_id
+    ).exclude(user=request.user).values_list('user_id', 'user__username', 'last_read_message_id'))
+    usernames = {user_id: username for user_id, username, _ in other_members}
+    
+    return table_response(request, 'messages', ROOM_MESSAGE_COLUMNS, rows, extra={
+        # Read receipts come from the other members' cursors rather than per-message flags:
+        # a message is read by every member whose cursor is >= its id
+        'read_cursors': [cursor for _, _, cursor in other_members],
+        'typing': [usernames[user_id] for user_id in typing_users(f'r{room_id}', usernames)],
+        'poll_interval': suggested_poll_interval(request)
+    }, dictionary_columns=('sender',))
+
+
+# Presence
+
+@skip_session_save
+@login_required
+@rate_limit('presence', methods=('POST',))
+def presence_heartbeat(request):
+    """Mark the current user online; `typing` names the conversation they are typing in"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    
+    typing = request.POST.get('typing', '')
+    if not CONVERSATION_KEY_RE.match(typing):
+        typing = None
+    
+    stopped = request.POST.get('stopped_typing', '')
+    if CONVERSATION_KEY_RE.match(stopped):
+        stop_typing(request.user.id, stopped)
+    
+    heartbeat(request.user.id, typing_in=typing)
+    return JsonResponse({
+        'status': 'ok',
+        'heartbeat_interval': heartbeat_interval_ms()
+    })
+
+
+# Monitoring
+
+def metrics_endpoint(request):
+    """Prometheus scrape endpoint for the request metrics middleware"""
+    if not getattr(settings, 'CHAT_METRICS_ENABLED', False):
+        raise Http404
+
+    token = getattr(settings, 'CHAT_METRICS_TOKEN', '')
+    auth_header = request.headers.get('Authorization', '')
+    has_token = token and constant_time_compare(auth_header, f'Bearer {token}')
+    if not has_token and not request.user.is_staff:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+
+    return HttpResponse(
+        metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )